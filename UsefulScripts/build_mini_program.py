@@ -1,15 +1,43 @@
 #!/usr/bin/env python3
 import os
 import json
+import shutil
+import hashlib
+import plistlib
 import subprocess
 import argparse
 import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 计算源文件哈希时跳过的目录和文件（版本库目录、Finder 等系统生成的元数据文件）
+SKIP_NAMES = {".git", ".svn", ".hg", ".DS_Store", "Thumbs.db", "desktop.ini"}
+
+class BuildError(Exception):
+    """构建失败"""
+
+class PhaseTimer:
+    """记录各阶段耗时（秒）"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
 def load_config(config_path):
     """加载配置文件"""
     try:
@@ -34,16 +62,97 @@ def get_wechat_devtool_cli():
         exit(1)
     return cli_path
 
-def build_mini_program(project_path, output_path, version, desc):
-    """执行小程序构建"""
-    cli_path = get_wechat_devtool_cli()
+def get_cli_version(cli_path):
+    """读取开发者工具的版本号（Mac 应用包的 Info.plist），读不到时用 CLI 文件的大小和修改时间代替"""
+    info_plist = Path(cli_path).resolve().parent.parent / "Info.plist"
+    try:
+        with open(info_plist, "rb") as f:
+            info = plistlib.load(f)
+        return f"{info['CFBundleShortVersionString']} ({info.get('CFBundleVersion', '')})"
+    except (OSError, KeyError, plistlib.InvalidFileException):
+        st = os.stat(cli_path)
+        return f"{st.st_size}-{st.st_mtime_ns}"
+
+def hash_project(project_path, exclude=()):
+    """按相对路径顺序计算项目所有源文件的 SHA256，exclude 中的目录（如项目内的输出目录）不参与计算"""
+    project_path = Path(project_path)
+    exclude = {Path(p).resolve() for p in exclude}
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(project_path):
+        root = Path(root)
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_NAMES and (root / d).resolve() not in exclude)
+        for name in sorted(f for f in files if f not in SKIP_NAMES):
+            path = root / name
+            h.update(f"{path.relative_to(project_path).as_posix()}\0{path.stat().st_size}\0".encode("utf-8"))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+    return h.hexdigest()
+
+def build_cache_key(project_path, version, desc, cli_path, exclude=()):
+    """构建缓存的键：源文件哈希 + 版本号 + 描述 + 开发者工具版本"""
+    key = {
+        "sources": hash_project(project_path, exclude),
+        "version": version,
+        "desc": desc,
+        "cli": get_cli_version(cli_path),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+def restore_output(cached, output_path):
+    """用缓存的构建产物替换输出目录"""
+    if output_path.exists():
+        shutil.rmtree(output_path)
+    shutil.copytree(cached, output_path)
+
+def store_output(output_path, cached):
+    """把构建产物复制进缓存，先写临时目录再改名，避免并行构建读到不完整的缓存"""
+    tmp = cached.with_name(f"{cached.name}.tmp-{os.getpid()}")
+    shutil.copytree(output_path, tmp)
+    try:
+        os.replace(tmp, cached)
+    except OSError:
+        # 其他进程已经写入了同一个缓存
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def measure_output(output_path):
+    """统计输出目录的文件数和总字节数"""
+    files = size = 0
+    for root, _, names in os.walk(output_path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def build_mini_program(project_path, output_path, version, desc, cli_path=None, cache_dir=None, timer=None, name=None):
+    """执行小程序构建，失败时抛出 BuildError
+
+    CLI 的输出边构建边逐行写入日志（以 name 为前缀）；各阶段耗时记录到 timer。
+    指定 cache_dir 时先查构建缓存，命中则直接恢复之前的构建产物而不调用 CLI，返回 True；
+    否则构建后把产物存入缓存，返回 False
+    """
+    cli_path = cli_path or get_wechat_devtool_cli()
+    timer = timer or PhaseTimer()
     project_path = Path(project_path).resolve()
     output_path = Path(output_path).resolve()
+    name = name or project_path.name
 
     # 确保项目路径存在
     if not project_path.exists():
-        logger.error(f"项目路径 {project_path} 不存在")
-        exit(1)
+        raise BuildError(f"项目路径 {project_path} 不存在")
+
+    cached = None
+    if cache_dir:
+        cache_dir = Path(cache_dir).resolve()
+        with timer.phase("cache_lookup"):
+            key = build_cache_key(project_path, version, desc, cli_path, exclude=[output_path, cache_dir])
+            cached = cache_dir / key
+            hit = cached.is_dir()
+            if hit:
+                restore_output(cached, output_path)
+        if hit:
+            logger.info(f"命中构建缓存 {key[:12]}，已恢复构建产物到 {output_path}")
+            return True
 
     # 创建输出目录
     output_path.mkdir(parents=True, exist_ok=True)
@@ -59,35 +168,162 @@ def build_mini_program(project_path, output_path, version, desc):
     ]
 
     logger.info(f"执行构建命令: {' '.join(cmd)}")
+    # 保留最后几十行输出，失败时放进错误信息
+    tail = deque(maxlen=50)
+    with timer.phase("build"):
+        try:
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as proc:
+                for line in proc.stdout:
+                    line = line.rstrip()
+                    tail.append(line)
+                    logger.info(f"[{name}] {line}")
+        except OSError as e:
+            raise BuildError(f"无法执行 CLI: {e}")
+    if proc.returncode != 0:
+        raise BuildError(f"构建失败（退出码 {proc.returncode}）:\n" + "\n".join(tail))
+    logger.info("构建成功！")
+
+    if cached is not None:
+        with timer.phase("cache_store"):
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            store_output(output_path, cached)
+    return False
+
+def load_builds(config):
+    """从配置中读取构建列表
+
+    兼容只有 project_path 的单项目配置；projects 为项目列表，每项可以覆盖顶层的
+    output_path、version、desc，并可用 variants 列出同一项目的多个变体
+    """
+    defaults = {
+        "output_path": config.get("output_path", "dist"),
+        "version": config.get("version", "1.0.0"),
+        "desc": config.get("desc", "Automated build"),
+        "cache_dir": config.get("cache_dir"),
+    }
+    projects = config.get("projects")
+    if projects is None:
+        projects = [{"project_path": config["project_path"]}] if config.get("project_path") else []
+
+    builds = []
+    for item in projects:
+        if isinstance(item, str):
+            item = {"project_path": item}
+        variants = item.get("variants") or [{}]
+        for variant in variants:
+            build = dict(defaults, **{k: v for k, v in item.items() if k != "variants"})
+            build.update(variant)
+            if not build.get("project_path"):
+                raise ValueError("projects 中有项目缺少 project_path 参数")
+            name = item.get("name") or Path(build["project_path"]).name
+            if variant.get("name"):
+                name = f"{name}-{variant['name']}"
+            build["name"] = name
+            # 多个构建没有单独指定输出目录时，按名称分开存放
+            if "output_path" not in item and "output_path" not in variant and (len(projects) > 1 or len(variants) > 1):
+                build["output_path"] = str(Path(defaults["output_path"]) / name)
+            builds.append(build)
+
+    names = [build["name"] for build in builds]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"构建名称重复: {', '.join(duplicated)}，请用 name 区分")
+    return builds
+
+def run_build(build, cli_path):
+    """执行一个构建，返回包含各阶段耗时和产物大小的结果摘要；任何异常都记为该构建的错误，不会中断整个矩阵"""
+    timer = PhaseTimer()
+    start = time.perf_counter()
+    cached = False
+    output_files = output_bytes = None
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        logger.info("构建成功！")
-        logger.debug(result.stdout)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"构建失败: {e.stderr}")
-        exit(1)
+        cached = build_mini_program(build["project_path"], build["output_path"], build["version"], build["desc"],
+                                    cli_path, build.get("cache_dir"), timer, build["name"])
+        with timer.phase("output_size"):
+            output_files, output_bytes = measure_output(build["output_path"])
+        error = None
+    except BuildError as e:
+        logger.error(f"[{build['name']}] {e}")
+        error = str(e)
+    except Exception as e:
+        logger.exception(f"[{build['name']}] 构建过程中出现意外错误")
+        error = f"{type(e).__name__}: {e}"
+    return {"name": build["name"], "ok": error is None, "cached": cached, "seconds": time.perf_counter() - start,
+            "phases": timer.phases, "output_files": output_files, "output_bytes": output_bytes, "error": error}
+
+def build_matrix(builds, cli_path, jobs):
+    """用最多 jobs 个进程并行执行所有构建，按配置顺序返回每个构建的结果"""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_build, build, cli_path) for build in builds]
+        return [future.result() for future in futures]
+
+def log_summary(results):
+    """输出每个构建的结果"""
+    logger.info("构建结果：")
+    for result in results:
+        status = ("成功（缓存）" if result["cached"] else "成功") if result["ok"] else "失败"
+        logger.info(f"  {result['name']}: {status} ({result['seconds']:.1f}s)")
+
+def write_report(path, started_at, timer, total_seconds, results):
+    """把本次构建的各阶段耗时和每个构建的结果写成 JSON 报告"""
+    report = {
+        "started_at": started_at,
+        "total_seconds": total_seconds,
+        "phases": timer.phases,
+        "builds": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"构建报告已写入 {path}")
 
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description="微信小程序自动化打包脚本")
     parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="同时进行的构建数（默认 CPU 核数）")
+    parser.add_argument("--cache-dir", help="构建缓存目录，源文件和参数都没变时直接恢复之前的产物（也可在配置中设置 cache_dir）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用构建缓存")
+    parser.add_argument("--report", help="把各阶段耗时写入该 JSON 文件，便于跟踪构建耗时的变化")
     args = parser.parse_args()
 
-    # 加载配置文件
-    config = load_config(args.config)
+    started_at = datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    timer = PhaseTimer()
 
-    # 从配置文件获取参数
-    project_path = config.get("project_path")
-    output_path = config.get("output_path", "dist")
-    version = config.get("version", "1.0.0")
-    desc = config.get("desc", "Automated build")
+    # 加载配置文件，从配置文件获取构建列表
+    with timer.phase("config_load"):
+        config = load_config(args.config)
+        try:
+            builds = load_builds(config)
+        except ValueError as e:
+            logger.error(str(e))
+            exit(1)
 
-    if not project_path:
-        logger.error("配置文件中缺少 project_path 参数")
+    if not builds:
+        logger.error("配置文件中缺少 project_path 或 projects 参数")
         exit(1)
 
+    for build in builds:
+        if args.no_cache:
+            build["cache_dir"] = None
+        elif args.cache_dir:
+            build["cache_dir"] = args.cache_dir
+
+    with timer.phase("cli_discovery"):
+        cli_path = get_wechat_devtool_cli()
+
     # 执行构建
-    build_mini_program(project_path, output_path, version, desc)
+    with timer.phase("builds"):
+        if len(builds) == 1:
+            results = [run_build(builds[0], cli_path)]
+        else:
+            results = build_matrix(builds, cli_path, args.jobs)
+            log_summary(results)
+
+    if args.report:
+        write_report(args.report, started_at, timer, time.perf_counter() - start, results)
+    if not all(result["ok"] for result in results):
+        exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,40 +1,168 @@
 import speech_recognition as sr
 from googletrans import Translator, LANGUAGES
 from pydub import AudioSegment
+from pydub.silence import split_on_silence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import argparse
+import asyncio
+import hashlib
+import inspect
+import json
 import os
+import sqlite3
+import threading
+import time
 
-def convert_audio_to_wav(audio_file):
-    """将音频文件（包括 M4A）转换为 WAV 格式"""
+# 长音频切分后每段的最大长度（毫秒），Google 识别单次请求不宜超过约 1 分钟
+MAX_CHUNK_MS = 50 * 1000
+SUPPORTED_FORMATS = ['.wav', '.mp3', '.m4a']
+# 批量翻译时每次请求拼接的最大字符数，googletrans 单次请求上限约 5000 字符
+MAX_BATCH_CHARS = 4500
+
+class GoogleRecognizer:
+    """Google Speech Recognition（需要联网）"""
+
+    # 识别时使用的采样率，音频在内存中先重采样为单声道的这个采样率
+    sample_rate = 16000
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognize(self, audio_data):
+        return sr.Recognizer().recognize_google(audio_data, language=self.language)
+
+class SphinxRecognizer:
+    """CMU Sphinx 离线识别（需要安装 pocketsphinx）"""
+
+    sample_rate = 16000
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognize(self, audio_data):
+        return sr.Recognizer().recognize_sphinx(audio_data, language=self.language)
+
+class StubRecognizer:
+    """测试用识别器：不联网，返回音频片段的时长"""
+
+    sample_rate = 16000
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognize(self, audio_data):
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        return f"<{seconds:.1f}s>"
+
+RECOGNIZERS = {"google": GoogleRecognizer, "sphinx": SphinxRecognizer, "stub": StubRecognizer}
+
+class ResultCache:
+    """SQLite 结果缓存：转录按音频内容哈希，翻译按 (文本, 目标语言)，可在多个线程间共享"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS transcripts (audio_hash TEXT, recognizer TEXT, "
+                          "language TEXT, text TEXT, PRIMARY KEY (audio_hash, recognizer, language))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS translations (text TEXT, target TEXT, "
+                          "translated TEXT, PRIMARY KEY (text, target))")
+        self.conn.commit()
+
+    def key_lock(self, *key):
+        """每个缓存键一把锁：多个线程同时遇到同一内容时，只有一个去识别或翻译，其余等待后读缓存"""
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get_transcript(self, audio_hash, recognizer, language):
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM transcripts WHERE audio_hash=? AND recognizer=? AND language=?",
+                                    (audio_hash, recognizer, language)).fetchone()
+        return row[0] if row else None
+
+    def put_transcript(self, audio_hash, recognizer, language, text):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)",
+                              (audio_hash, recognizer, language, text))
+            self.conn.commit()
+
+    def get_translation(self, text, target):
+        with self.lock:
+            row = self.conn.execute("SELECT translated FROM translations WHERE text=? AND target=?",
+                                    (text, target)).fetchone()
+        return row[0] if row else None
+
+    def put_translation(self, text, target, translated):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?)", (text, target, translated))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def audio_data_hash(audio_data):
+    """音频内容哈希：对解码后的 PCM 数据计算，与文件名和容器格式无关"""
+    h = hashlib.sha256(f"{audio_data.sample_rate}:{audio_data.sample_width}:".encode())
+    h.update(audio_data.frame_data)
+    return h.hexdigest()
+
+class CachingRecognizer:
+    """给识别后端加上缓存：内容相同的音频片段只识别一次，无法识别的结果也会缓存"""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.sample_rate = backend.sample_rate
+        self.name = type(backend).__name__
+
+    def recognize(self, audio_data):
+        key = audio_data_hash(audio_data)
+        with self.cache.key_lock("transcript", key):
+            text = self.cache.get_transcript(key, self.name, self.backend.language)
+            if text is None:
+                try:
+                    text = self.backend.recognize(audio_data)
+                except sr.UnknownValueError:
+                    text = ""
+                self.cache.put_transcript(key, self.name, self.backend.language, text)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+def to_recognizer_format(audio, sample_rate):
+    """转换为识别需要的单声道、16 位、指定采样率的 PCM"""
+    return audio.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+
+def load_audio_data(audio_file, sample_rate=16000):
+    """在内存中解码音频并重采样，直接返回可以识别的 AudioData，不写临时文件"""
     try:
-        # 支持的音频格式
-        supported_formats = ['.wav', '.mp3', '.m4a']
         file_ext = os.path.splitext(audio_file)[1].lower()
-        
-        if file_ext not in supported_formats:
-            print(f"不支持的音频格式：{file_ext}。支持的格式：{', '.join(supported_formats)}")
+        if file_ext not in SUPPORTED_FORMATS:
+            print(f"不支持的音频格式：{file_ext}。支持的格式：{', '.join(SUPPORTED_FORMATS)}")
             return None
-        
-        if file_ext != '.wav':
-            print(f"正在将 {audio_file} 转换为 WAV 格式...")
-            audio = AudioSegment.from_file(audio_file)
-            wav_file = "temp_audio.wav"
-            audio.export(wav_file, format="wav")
-            return wav_file
-        return audio_file
+        audio = to_recognizer_format(AudioSegment.from_file(audio_file), sample_rate)
+        return sr.AudioData(audio.raw_data, sample_rate, 2)
     except Exception as e:
         print(f"音频转换失败：{e}")
         return None
 
-def speech_to_text(audio_file):
-    """将语音转换为文字"""
+def speech_to_text(audio_file, backend=None):
+    """将语音转换为文字，默认使用 Google Speech Recognition
+
+    audio_file 可以是 WAV 文件路径，也可以是 load_audio_data 得到的 AudioData
+    """
+    backend = backend or GoogleRecognizer()
     recognizer = sr.Recognizer()
     try:
-        with sr.AudioFile(audio_file) as source:
-            audio_data = recognizer.record(source)
-            # 使用 Google Speech Recognition 转换为文字
-            text = recognizer.recognize_google(audio_data)
-            print("转录文本：", text)
-            return text
+        if isinstance(audio_file, sr.AudioData):
+            audio_data = audio_file
+        else:
+            with sr.AudioFile(audio_file) as source:
+                audio_data = recognizer.record(source)
+        text = backend.recognize(audio_data)
+        print("转录文本：", text)
+        return text
     except sr.UnknownValueError:
         print("无法识别音频内容")
         return None
@@ -45,23 +173,284 @@ def speech_to_text(audio_file):
         print(f"转录过程中出错：{e}")
         return None
 
-def translate_text(text, target_language):
-    """将文本翻译成指定语言"""
+def split_on_pauses(audio, max_chunk_ms=MAX_CHUNK_MS, min_silence_len=700, keep_silence=300):
+    """按停顿切分音频，相邻的短片段合并到不超过 max_chunk_ms，没有停顿的超长片段按时长切开"""
+    pieces = split_on_silence(audio, min_silence_len=min_silence_len, silence_thresh=audio.dBFS - 16,
+                              keep_silence=keep_silence, seek_step=10)
+    chunks = []
+    for piece in pieces:
+        for start in range(0, len(piece), max_chunk_ms):
+            part = piece[start:start + max_chunk_ms]
+            if chunks and len(chunks[-1]) + len(part) <= max_chunk_ms:
+                chunks[-1] += part
+            else:
+                chunks.append(part)
+    return chunks
+
+def recognize_chunk(backend, index, chunk):
+    """识别一个音频片段，失败时返回空字符串"""
+    audio_data = sr.AudioData(chunk.raw_data, chunk.frame_rate, chunk.sample_width)
+    try:
+        return backend.recognize(audio_data)
+    except sr.UnknownValueError:
+        return ""
+    except sr.RequestError as e:
+        print(f"第 {index + 1} 段语音识别请求失败：{e}")
+        return ""
+    except Exception as e:
+        print(f"第 {index + 1} 段识别过程中出错：{e}")
+        return ""
+
+def transcribe_segments(audio_file, backend=None, workers=4, max_chunk_ms=MAX_CHUNK_MS):
+    """长音频按停顿切成片段，由 workers 个线程并行识别，按原顺序返回每段的文本，读取失败返回 None"""
+    backend = backend or GoogleRecognizer()
+    try:
+        audio = to_recognizer_format(AudioSegment.from_file(audio_file), backend.sample_rate)
+    except Exception as e:
+        print(f"读取音频失败：{e}")
+        return None
+    chunks = split_on_pauses(audio, max_chunk_ms)
+    print(f"音频时长 {len(audio) / 1000:.0f} 秒，切分为 {len(chunks)} 段")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(recognize_chunk, backend), range(len(chunks)), chunks))
+
+def transcribe_long_audio(audio_file, backend=None, workers=4, max_chunk_ms=MAX_CHUNK_MS):
+    """长音频按停顿切成片段，由 workers 个线程并行识别，再按原顺序拼接"""
+    texts = transcribe_segments(audio_file, backend, workers, max_chunk_ms)
+    if texts is None:
+        return None
+    text = " ".join(t for t in texts if t)
     if not text:
+        print("无法识别音频内容")
         return None
+    print("转录文本：", text)
+    return text
+
+class GoogleTranslator:
+    """googletrans 在线翻译，兼容同步的 3.x 和异步的 4.x 接口"""
+
+    def __init__(self):
+        self.is_async = inspect.iscoroutinefunction(Translator.translate)
+        if self.is_async:
+            # 4.x 的 Translator 绑定在创建它的事件循环上：放到后台线程的循环里，所有线程共用一个连接池
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.thread.start()
+            self.translator = asyncio.run_coroutine_threadsafe(self._create(), self.loop).result()
+        else:
+            self.translator = Translator()
+
+    @staticmethod
+    async def _create():
+        return Translator()
+
+    def translate(self, text, dest):
+        result = self.translator.translate(text, dest=dest)
+        if self.is_async:
+            result = asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        return result.text
+
+    def close(self):
+        """关闭连接并停止后台事件循环（同步接口时无需处理）"""
+        if not self.is_async or self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.translator.__aexit__(None, None, None), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def translate_batch(self, texts, dest):
+        """多段文本按行拼成一次请求，返回的行数对不上时退回逐段翻译"""
+        lines = self.translate("\n".join(t.replace("\n", " ") for t in texts), dest).split("\n")
+        if len(lines) == len(texts):
+            return [line.strip() for line in lines]
+        return [self.translate(t, dest) for t in texts]
+
+class StubTranslator:
+    """测试用翻译器：不联网，在原文前加上目标语言，并记录请求次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def translate_batch(self, texts, dest):
+        self.calls += 1
+        return [f"[{dest}] {t}" for t in texts]
+
+    def close(self):
+        pass
+
+TRANSLATORS = {"google": GoogleTranslator, "stub": StubTranslator}
+
+_default_translator = None
+_default_translator_lock = threading.Lock()
+
+def default_translator():
+    """未指定翻译后端时使用的 GoogleTranslator，整个进程只创建一个"""
+    global _default_translator
+    with _default_translator_lock:
+        if _default_translator is None:
+            _default_translator = GoogleTranslator()
+        return _default_translator
+
+def pack_batches(texts, max_chars=MAX_BATCH_CHARS):
+    """按顺序把文本装成若干批，每批拼接后（含换行分隔）不超过 max_chars，超长的单段单独成一批"""
+    batches, size = [], 0
+    for text in texts:
+        if batches and size + 1 + len(text) <= max_chars:
+            batches[-1].append(text)
+            size += 1 + len(text)
+        else:
+            batches.append([text])
+            size = len(text)
+    return batches
+
+def translate_batch_with_retry(translator, texts, target_language, retries=3, backoff=1.0):
+    """翻译一批文本，失败后按 backoff、2*backoff、4*backoff... 秒重试，重试用尽返回 None"""
+    for attempt in range(retries + 1):
+        try:
+            result = translator.translate_batch(texts, target_language)
+            if len(result) != len(texts):
+                raise ValueError(f"返回 {len(result)} 段译文，应为 {len(texts)} 段")
+            return result
+        except Exception as e:
+            if attempt == retries:
+                print(f"翻译失败（{len(texts)} 段，已重试 {retries} 次）：{e}")
+                return None
+            delay = backoff * 2 ** attempt
+            print(f"翻译失败：{e}，{delay:.1f} 秒后重试")
+            time.sleep(delay)
+
+def translate_segments(segments, target_language, translator=None, cache=None,
+                       max_chars=MAX_BATCH_CHARS, retries=3, backoff=1.0):
+    """批量翻译片段：segments 是 {片段 ID: 文本}，返回 {片段 ID: 译文}
+
+    相同的文本只翻译一次，未缓存的文本按 max_chars 装批，每批单独重试；
+    某一批最终失败时只有这一批的片段译文为 None
+    """
+    translator = translator or default_translator()
+    texts = list(dict.fromkeys(t for t in segments.values() if t))
+    # 按固定顺序拿每段文本的锁，避免线程间死锁，也避免并发时同一文本被重复翻译
+    locks = [cache.key_lock("translation", t, target_language) for t in sorted(texts)] if cache is not None else []
+    for lock in locks:
+        lock.acquire()
     try:
-        translator = Translator()
-        translated = translator.translate(text, dest=target_language)
-        print(f"翻译成 {LANGUAGES.get(target_language, target_language)}：{translated.text}")
-        return translated.text
-    except Exception as e:
-        print(f"翻译失败：{e}")
+        translated = {}
+        if cache is not None:
+            for text in texts:
+                cached = cache.get_translation(text, target_language)
+                if cached is not None:
+                    translated[text] = cached
+        pending = [t for t in texts if t not in translated]
+        for batch in pack_batches(pending, max_chars):
+            result = translate_batch_with_retry(translator, batch, target_language, retries, backoff)
+            for text, value in zip(batch, result or []):
+                translated[text] = value
+                if cache is not None:
+                    cache.put_translation(text, target_language, value)
+    finally:
+        for lock in locks:
+            lock.release()
+    return {sid: translated.get(text) if text else None for sid, text in segments.items()}
+
+def translate_text(text, target_language, translator=None, cache=None):
+    """将文本翻译成指定语言
+
+    translator 是翻译后端（默认 GoogleTranslator），多次调用时传入同一个以复用连接；
+    传入 cache 时相同的 (文本, 目标语言) 只翻译一次
+    """
+    if not text:
         return None
+    translated = translate_segments({0: text}, target_language, translator, cache)[0]
+    if translated:
+        print(f"翻译成 {LANGUAGES.get(target_language, target_language)}：{translated}")
+    return translated
+
+def iter_audio_files(directory):
+    """递归列出目录下所有支持格式的音频文件"""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_FORMATS:
+                yield os.path.join(dirpath, filename)
+
+def process_file(audio_file, output_file, target_language, backend, translator=None, cache=None, chunked=False,
+                 max_chars=MAX_BATCH_CHARS):
+    """转录并翻译一个音频文件，按片段写入 JSON 结果文件，返回结果字典
+
+    所有片段通过 translate_segments 合并成少数几次翻译请求
+    """
+    if chunked:
+        texts = transcribe_segments(audio_file, backend, workers=1)
+    else:
+        audio_data = load_audio_data(audio_file, backend.sample_rate)
+        texts = None if audio_data is None else [speech_to_text(audio_data, backend) or ""]
+    translations = translate_segments(dict(enumerate(texts or [])), target_language, translator, cache, max_chars)
+    segments = [{"id": index, "text": text, "translation": translations[index]}
+                for index, text in enumerate(texts or [])]
+    result = {
+        "source": audio_file,
+        "target_language": target_language,
+        "text": " ".join(s["text"] for s in segments if s["text"]) or None,
+        "translation": " ".join(s["translation"] for s in segments if s["translation"]) or None,
+        "segments": segments,
+        "error": "音频读取失败" if texts is None else None,
+    }
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+def batch_process(directory, output_dir, target_language, backend, cache, workers=4, chunked=False,
+                  translator=None, max_chars=MAX_BATCH_CHARS):
+    """批量处理目录下的音频：workers 个线程并行，每个输入在 output_dir 下生成对应的 .json 结果
+
+    所有线程共用一个翻译后端和同一个缓存，内容相同的音频片段和文本不会重复识别或翻译
+    """
+    backend = CachingRecognizer(backend, cache)
+    translator = translator or default_translator()
+    files = list(iter_audio_files(directory))
+    print(f"共找到 {len(files)} 个音频文件")
+    ok = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for audio_file in files:
+            relpath = os.path.relpath(audio_file, directory)
+            output_file = os.path.join(output_dir, relpath + ".json")
+            futures[executor.submit(process_file, audio_file, output_file, target_language,
+                                    backend, translator, cache, chunked, max_chars)] = audio_file
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(files)}] {futures[future]} 处理失败：{e}")
+                continue
+            if result["text"]:
+                ok += 1
+            print(f"[{done}/{len(files)}] {futures[future]} 完成")
+    print(f"批量处理完成：{ok}/{len(files)} 个文件识别成功，结果保存在 {output_dir}")
 
 def main():
+    parser = argparse.ArgumentParser(description="语音转文字并翻译")
+    parser.add_argument("audio_file", nargs="?", help="音频文件路径，是目录时批量处理其中所有音频，不指定则交互输入")
+    parser.add_argument("target_language", nargs="?", help="目标语言代码，不指定则交互输入")
+    parser.add_argument("--chunked", action="store_true", help="按停顿切分长音频并行识别，适合很长的录音")
+    parser.add_argument("--workers", type=int, default=4, help="并行识别的线程数（默认 4）")
+    parser.add_argument("--recognizer", choices=sorted(RECOGNIZERS), default="google",
+                        help="识别后端：google（联网）、sphinx（离线）、stub（测试用）")
+    parser.add_argument("--language", default="en-US", help="音频的语言（默认 en-US）")
+    parser.add_argument("--output-dir", default="transcripts",
+                        help="audio_file 是目录时批量处理，每个音频的 JSON 结果写到这里（默认 transcripts）")
+    parser.add_argument("--cache", help="转录和翻译缓存的 SQLite 文件（批量处理默认 <output-dir>/cache.sqlite）")
+    parser.add_argument("--translator", choices=sorted(TRANSLATORS), default="google",
+                        help="翻译后端：google（联网）、stub（测试用）")
+    parser.add_argument("--batch-chars", type=int, default=MAX_BATCH_CHARS,
+                        help=f"批量翻译时每次请求的最大字符数（默认 {MAX_BATCH_CHARS}）")
+    args = parser.parse_args()
+    backend = RECOGNIZERS[args.recognizer](args.language)
+
     # 配置信息
-    audio_file = input("请输入音频文件路径（例如 input_audio.m4a）：")
-    target_language = input("请输入目标语言代码（例如 en, zh-cn, es）：")
+    audio_file = args.audio_file or input("请输入音频文件路径（例如 input_audio.m4a）：")
+    target_language = args.target_language or input("请输入目标语言代码（例如 en, zh-cn, es）：")
 
     # 验证语言代码
     if target_language.lower() not in LANGUAGES:
@@ -73,28 +462,41 @@ def main():
         print(f"错误：音频文件 {audio_file} 不存在！")
         return
 
-    # 转换为 WAV 格式（如果需要）
-    wav_file = convert_audio_to_wav(audio_file)
-    if not wav_file:
-        return
+    translator = TRANSLATORS[args.translator]()
+    try:
+        if os.path.isdir(audio_file):
+            os.makedirs(args.output_dir, exist_ok=True)
+            cache = ResultCache(args.cache or os.path.join(args.output_dir, "cache.sqlite"))
+            try:
+                batch_process(audio_file, args.output_dir, target_language.lower(), backend, cache,
+                              args.workers, args.chunked, translator, args.batch_chars)
+            finally:
+                cache.close()
+            return
+
+        if args.chunked:
+            text = transcribe_long_audio(audio_file, backend, args.workers)
+        else:
+            # 在内存中解码并重采样，不写临时 WAV 文件
+            audio_data = load_audio_data(audio_file, backend.sample_rate)
+            if audio_data is None:
+                return
 
-    # 语音转文字
-    text = speech_to_text(wav_file)
-    if text:
-        # 翻译文本
-        translated_text = translate_text(text, target_language.lower())
-        if translated_text:
-            # 保存结果到文件
-            output_file = "output_text.txt"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(f"原始文本: {text}\n")
-                f.write(f"翻译文本 ({target_language}): {translated_text}\n")
-            print(f"结果已保存到 {output_file}")
-
-    # 清理临时 WAV 文件
-    if wav_file != audio_file and os.path.exists(wav_file):
-        os.remove(wav_file)
-        print(f"已删除临时文件 {wav_file}")
+            # 语音转文字
+            text = speech_to_text(audio_data, backend)
+        if text:
+            # 翻译文本
+            translated_text = translate_text(text, target_language.lower(), translator)
+            if translated_text:
+                # 保存结果到文件
+                output_file = "output_text.txt"
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write(f"原始文本: {text}\n")
+                    f.write(f"翻译文本 ({target_language}): {translated_text}\n")
+                print(f"结果已保存到 {output_file}")
+    finally:
+        # 关闭翻译后端，googletrans 4.x 时会停止后台事件循环并关闭连接
+        translator.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,38 +1,454 @@
 # -*- coding: utf8 -*-
 
-import os, sys
-from win32com.client import Dispatch, constants
+import os, sys, time, json, signal, hashlib, shutil, subprocess, threading, argparse
+import Queue
 
 reload(sys)
 sys.setdefaultencoding('utf8')
 
 """
-获取所有的docx文档
+边遍历边逐个返回docx文档
 """
-def fetchAllFile(path):
-    files = []
+def iterAllFile(path):
     for dirpath, dirnames, filenames in os.walk(path):
         for file in filenames:
             ext = os.path.splitext(file)[1].lower()
             if ext == '.docx' or ext == '.doc':
-                fullpath = os.path.join(dirpath, file)
-                files.append(fullpath)
-    return files
+                yield os.path.join(dirpath, file)
+
+"""
+获取所有的docx文档
+"""
+def fetchAllFile(path):
+    return list(iterAllFile(path))
+
+"""
+使用一个常驻的 Word 实例转换文档（仅 Windows）
+"""
+class WordConverter(object):
+    def __init__(self):
+        import pythoncom
+        from win32com.client import DispatchEx, constants
+        # 每个工作线程各自初始化 COM，各自拥有一个 Word 进程
+        pythoncom.CoInitialize()
+        self.constants = constants
+        self.word = DispatchEx("Word.Application")
+        self.word.Visible = False
+
+    def convert(self, docxPath, pdfPath):
+        c = self.constants
+        doc = self.word.Documents.Open(docxPath, ReadOnly=1)
+        try:
+            doc.ExportAsFixedFormat(pdfPath, c.wdExportFormatPDF, Item=c.wdExportDocumentWithMarkup, CreateBookmarks=c.wdExportCreateHeadingBookmarks)
+        finally:
+            doc.Close(c.wdDoNotSaveChanges)
+
+    def close(self):
+        import pythoncom
+        self.word.Quit(self.constants.wdDoNotSaveChanges)
+        pythoncom.CoUninitialize()
+
+"""
+UNO 辅助脚本，由 Python 3 执行：启动一个常驻的 headless soffice 并通过 UNO 连接，
+然后从 stdin 逐行读取 {"src", "dst"} 请求，转换后向 stdout 逐行回复 {"ok"} 或 {"error"}；
+stdin 关闭时退出 LibreOffice 并删除用户配置目录
+"""
+UNO_HELPER = r"""
+import json, shutil, socket, subprocess, sys, tempfile, time
+import uno
+from com.sun.star.beans import PropertyValue
+
+def props(**kwargs):
+    result = []
+    for name, value in kwargs.items():
+        p = PropertyValue()
+        p.Name, p.Value = name, value
+        result.append(p)
+    return tuple(result)
+
+def reply(**kwargs):
+    sys.stdout.write(json.dumps(kwargs) + '\n')
+    sys.stdout.flush()
+
+soffice, timeout = sys.argv[1], float(sys.argv[2])
+sock = socket.socket()
+sock.bind(('127.0.0.1', 0))
+port = sock.getsockname()[1]
+sock.close()
+profile = tempfile.mkdtemp(prefix='lo_profile_')
+proc = subprocess.Popen([soffice, '--headless', '--invisible', '--norestore', '--nologo', '--nodefault',
+                         '-env:UserInstallation=' + uno.systemPathToFileUrl(profile),
+                         '--accept=socket,host=127.0.0.1,port=%d;urp;' % port],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+try:
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            ctx = resolver.resolve('uno:socket,host=127.0.0.1,port=%d;urp;StarOffice.ComponentContext' % port)
+            break
+        except Exception:
+            if time.time() > deadline or proc.poll() is not None:
+                reply(error='LibreOffice 启动失败')
+                sys.exit(1)
+            time.sleep(0.5)
+    desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+    reply(ready=True, pid=proc.pid)
+    for line in sys.stdin:
+        task = json.loads(line)
+        try:
+            doc = desktop.loadComponentFromURL(uno.systemPathToFileUrl(task['src']), '_blank', 0,
+                                               props(Hidden=True, ReadOnly=True))
+            if doc is None:
+                raise IOError('无法打开文档：' + task['src'])
+            try:
+                doc.storeToURL(uno.systemPathToFileUrl(task['dst']), props(FilterName='writer_pdf_Export'))
+            finally:
+                doc.close(True)
+            reply(ok=True)
+        except Exception as e:
+            reply(error=str(e))
+    try:
+        desktop.terminate()
+    except Exception:
+        pass
+finally:
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    shutil.rmtree(profile, ignore_errors=True)
+"""
+
+"""
+使用一个常驻的 headless LibreOffice 转换文档
+
+当前 LibreOffice 只提供 Python 3 的 pyuno，本脚本运行在 Python 2 下无法 import uno，
+所以由一个 Python 3 辅助进程（UNO_HELPER）持有 UNO 连接，两边通过管道逐行传 JSON。
+每个转换器只启动一次 LibreOffice，之后的文档都交给同一个实例；转换超时或辅助进程退出时
+结束该实例，下一个文档再重新启动。soffice 和带 pyuno 的 Python 3 路径可以用环境变量
+SOFFICE 和 LO_PYTHON 指定（Windows/macOS 上可以用 LibreOffice 自带的 program/python）
+"""
+class LibreOfficeConverter(object):
+    def __init__(self, soffice=None, python=None, timeout=300, startTimeout=60):
+        self.soffice = soffice or os.environ.get('SOFFICE', 'soffice')
+        self.python = python or os.environ.get('LO_PYTHON', 'python3')
+        self.timeout = timeout
+        self.startTimeout = startTimeout
+        self.proc = None
+        self._start()
+
+    def _start(self):
+        try:
+            self.proc = subprocess.Popen([self.python, '-c', UNO_HELPER, self.soffice, str(self.startTimeout)],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError, e:
+            self.proc = None
+            raise RuntimeError('无法启动 %s：%s' % (self.python, e))
+        self.sofficePid = None
+        # 在后台线程里读回复，主线程等待时才能设置超时
+        self.replies = Queue.Queue()
+        reader = threading.Thread(target=self._read, args=(self.proc.stdout, self.replies))
+        reader.daemon = True
+        reader.start()
+        reply = self._reply(self.startTimeout + 10)
+        if reply is None or not reply.get('ready'):
+            self._kill()
+            raise RuntimeError((reply or {}).get('error') or 'LibreOffice 启动超时')
+        self.sofficePid = reply['pid']
+
+    @staticmethod
+    def _read(stream, replies):
+        for line in iter(stream.readline, ''):
+            replies.put(line)
+        replies.put(None)
+
+    def _reply(self, timeout):
+        try:
+            line = self.replies.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        if line is None:
+            return {'error': 'UNO 辅助进程已退出（请确认 LO_PYTHON 指向能 import uno 的 Python 3）', 'exited': True}
+        return json.loads(line)
+
+    def convert(self, docxPath, pdfPath):
+        if self.proc is None:
+            # 上一次转换超时或辅助进程崩溃，重新启动 LibreOffice
+            self._start()
+        request = json.dumps({'src': os.path.abspath(docxPath), 'dst': os.path.abspath(pdfPath)})
+        try:
+            self.proc.stdin.write(request + '\n')
+            self.proc.stdin.flush()
+        except IOError, e:
+            self._kill()
+            raise RuntimeError('UNO 辅助进程已退出：%s' % e)
+        reply = self._reply(self.timeout)
+        if reply is None:
+            self._kill()
+            raise RuntimeError('LibreOffice 转换超时：%s' % docxPath)
+        if reply.get('exited'):
+            self._kill()
+        if 'error' in reply:
+            raise IOError('LibreOffice 转换失败：%s %s' % (docxPath, reply['error']))
+
+    def _kill(self):
+        if self.sofficePid is not None:
+            try:
+                os.kill(self.sofficePid, signal.SIGTERM)
+            except OSError:
+                pass
+            self.sofficePid = None
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def close(self):
+        if self.proc is None:
+            return
+        # 关闭 stdin 后辅助进程会退出 LibreOffice 并清理配置目录
+        self.proc.stdin.close()
+        deadline = time.time() + 60
+        while self.proc.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if self.proc.poll() is not None:
+            # 辅助进程正常退出时已经等 LibreOffice 结束，不再按 pid 发信号，以免误杀复用了该 pid 的进程
+            self.sofficePid = None
+        self._kill()
+
+"""
+测试用的转换器：不依赖任何办公软件，写出一个占位 PDF
+"""
+class StubConverter(object):
+    instances = 0
+
+    def __init__(self, delay=0):
+        StubConverter.instances += 1
+        self.delay = delay
+
+    def convert(self, docxPath, pdfPath):
+        with open(docxPath, 'rb') as f:
+            size = len(f.read())
+        if self.delay:
+            time.sleep(self.delay)
+        with open(pdfPath, 'wb') as f:
+            f.write('%%PDF-1.4\n%% stub of %s (%d bytes)\n%%%%EOF\n' % (os.path.basename(docxPath), size))
+
+    def close(self):
+        pass
+
+BACKENDS = {'word': WordConverter, 'libreoffice': LibreOfficeConverter, 'stub': StubConverter}
+
+MANIFEST_NAME = '.convert_manifest.json'
+
+"""
+计算文件内容的 SHA1
+"""
+def fileHash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+"""
+转换清单：以 PDF 相对输出目录的路径为键，记录源文档的路径、哈希、大小和修改时间
+"""
+class Manifest(object):
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def __contains__(self, pdfKey):
+        return unicode(pdfKey) in self.entries
+
+    def isUpToDate(self, docPath, pdfKey):
+        """
+        大小和修改时间都没变时直接认为未修改；否则比较内容哈希，内容相同只更新记录
+        """
+        entry = self.entries.get(unicode(pdfKey))
+        if entry is None:
+            return False
+        st = os.stat(docPath)
+        if entry['size'] != st.st_size:
+            return False
+        if entry['source'] == unicode(docPath) and entry['mtime'] == st.st_mtime:
+            return True
+        digest = fileHash(docPath)
+        if digest != entry['hash']:
+            return False
+        self.record(docPath, pdfKey, digest)
+        return True
+
+    def record(self, docPath, pdfKey, digest=None):
+        st = os.stat(docPath)
+        self.entries[unicode(pdfKey)] = {'source': unicode(docPath), 'hash': digest or fileHash(docPath),
+                                         'size': st.st_size, 'mtime': st.st_mtime}
+
+    def orphans(self, docPaths):
+        """
+        返回源文档已被删除的 PDF
+        """
+        sources = set(unicode(p) for p in docPaths)
+        return sorted(pdf for pdf, entry in self.entries.items()
+                      if entry['source'] not in sources and not os.path.exists(entry['source']))
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+
+"""
+转换统计：吞吐、延迟分位数、失败数，以及生产者（遍历目录）和消费者（转换器）各自等待的时间，
+用来判断瓶颈在磁盘遍历还是在转换器
+"""
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.docs = 0
+        self.bytes = 0
+        self.failures = 0
+        self.latencies = []
+        self.producerBlocked = 0.0
+        self.workerIdle = 0.0
+
+    def done(self, docPath, latency, ok):
+        try:
+            size = os.path.getsize(docPath)
+        except OSError:
+            size = 0
+        with self.lock:
+            self.docs += 1
+            self.bytes += size
+            self.latencies.append(latency)
+            if not ok:
+                self.failures += 1
+
+    def percentile(self, p):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+
+    def report(self, queueDepth):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return (u"已转换 %d（%.1f 个/秒，%.1f KB/秒），队列 %d，延迟 p50/p90/p99 %.2f/%.2f/%.2f 秒，"
+                u"失败 %d，遍历阻塞 %.1f 秒，转换器空闲 %.1f 秒" % (
+                    self.docs, self.docs / elapsed, self.bytes / 1024.0 / elapsed, queueDepth,
+                    self.percentile(50), self.percentile(90), self.percentile(99),
+                    self.failures, self.producerBlocked, self.workerIdle))
+
+"""
+常驻转换器池：每个工作线程在拿到第一个文档时创建转换器，之后一直复用，从队列中依次取文档转换
+"""
+class ConverterPool(object):
+    def __init__(self, backend, workers=1, queueSize=None):
+        self.backend = backend
+        self.workers = workers
+        self.queueSize = queueSize or workers * 4
+        self.metrics = Metrics()
+
+    def _work(self, tasks, failures, onDone):
+        converter, startError = None, None
+        try:
+            while True:
+                waitStart = time.time()
+                task = tasks.get()
+                with self.metrics.lock:
+                    self.metrics.workerIdle += time.time() - waitStart
+                if task is None:
+                    return
+                if converter is None and startError is None:
+                    try:
+                        converter = self.backend()
+                    except Exception, e:
+                        print u"转换器启动失败：", e
+                        startError = e
+                start = time.time()
+                # 转换器起不来时仍要取完分到的任务，记为失败
+                error = startError
+                # 包括 onDone 在内的任何异常都只记为这个文档失败，线程继续取队列，
+                # 否则线程全部退出后生产者会永远阻塞在已满的有界队列上
+                try:
+                    if converter is not None:
+                        print u"转换文件：", task[0], task[1]
+                        converter.convert(task[0], task[1])
+                except Exception, e:
+                    print e
+                    error = e
+                try:
+                    if onDone is not None:
+                        onDone(task, error)
+                except Exception, e:
+                    print u"记录转换结果失败：", task[0], e
+                    error = error or e
+                if error is not None:
+                    failures.append((task[0], error))
+                self.metrics.done(task[0], time.time() - start, error is None)
+        finally:
+            if converter is not None:
+                converter.close()
+
+    def _reportLoop(self, queue, finished, interval):
+        while not finished.wait(interval):
+            print self.metrics.report(queue.qsize())
+
+    def convert(self, tasks, onDone=None, interval=10):
+        """
+        转换 (docPath, pdfPath) 序列，tasks 可以是边遍历边产出的生成器，通过有界队列交给转换器；
+        每个文档完成后调用 onDone(task, error)，每 interval 秒打印一次统计；返回失败的 (docPath, 异常) 列表
+        """
+        queue = Queue.Queue(self.queueSize)
+        failures = []
+        finished = threading.Event()
+        threads = [threading.Thread(target=self._work, args=(queue, failures, onDone)) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        reporter = None
+        if interval:
+            reporter = threading.Thread(target=self._reportLoop, args=(queue, finished, interval))
+            reporter.start()
+        try:
+            for task in tasks:
+                putStart = time.time()
+                queue.put(task)
+                self.metrics.producerBlocked += time.time() - putStart
+        finally:
+            for t in threads:
+                queue.put(None)
+            for t in threads:
+                t.join()
+            finished.set()
+            if reporter is not None:
+                reporter.join()
+        return failures
 
 """
 将WORD文档转换为PDF文件
 """
 def convertWordToPdf(docxPath, pdfPath):
-    w = Dispatch("Word.Application")
+    w = WordConverter()
     try:
-        doc = w.Documents.Open(docxPath, ReadOnly=1)
-        doc.ExportAsFixedFormat(pdfPath, constants.wdExportFormatPDF, Item=constants.wdExportDocumentWithMarkup, CreateBookmarks=constants.wdExportCreateHeadingBookmarks)
+        w.convert(docxPath, pdfPath)
     except Exception, e:
         print e
     finally:
-        w.Quit(constants.wdDoNotSaveChanges)
-        
-def main(src, dest):
+        w.close()
+
+def main(src, dest, backend='word', workers=1, queueSize=None, interval=10):
     docPath = src
     if not os.path.exists(docPath):
         print "path not exists"
@@ -40,18 +456,55 @@ def main(src, dest):
     pdfPath = dest
     if not os.path.exists(pdfPath):
         os.makedirs(pdfPath)
-    files = fetchAllFile(docPath)
-    for file in files:
-        identifier = file.split('\\')[-2]
-        fileName = os.path.splitext(os.path.basename(file))[0] + '.pdf'
-        if not os.path.exists(os.path.join(pdfPath, identifier)):
-            os.mkdir(os.path.join(pdfPath, identifier))
-        savePath = os.path.join(pdfPath, identifier, fileName)
-        if not os.path.exists(savePath):
-            print u"转换文件：", file, savePath
-            convertWordToPdf(file, savePath)
-        else:
-            print u"文件已经存在，无需转换"
-        
+    manifest = Manifest(os.path.join(pdfPath, MANIFEST_NAME))
+    lock = threading.Lock()
+    files = []
+    skipped = [0]
+
+    def discover():
+        for file in iterAllFile(docPath):
+            files.append(file)
+            identifier = os.path.basename(os.path.dirname(file))
+            fileName = os.path.splitext(os.path.basename(file))[0] + '.pdf'
+            pdfKey = os.path.join(identifier, fileName)
+            with lock:
+                if manifest.isUpToDate(file, pdfKey):
+                    skipped[0] += 1
+                    continue
+                savePath = os.path.join(pdfPath, pdfKey)
+                if pdfKey not in manifest and os.path.exists(savePath):
+                    # 清单建立之前就已转换好的 PDF，视为由当前源文档生成
+                    print u"文件已经存在，无需转换"
+                    manifest.record(file, pdfKey)
+                    skipped[0] += 1
+                    continue
+            if not os.path.exists(os.path.join(pdfPath, identifier)):
+                os.mkdir(os.path.join(pdfPath, identifier))
+            yield (file, savePath)
+
+    def onDone(task, error):
+        if error is None:
+            with lock:
+                manifest.record(task[0], os.path.relpath(task[1], pdfPath))
+
+    pool = ConverterPool(BACKENDS[backend], workers, queueSize)
+    failures = pool.convert(discover(), onDone, interval)
+    if pool.metrics.docs:
+        print u"转换完成：成功 %d，失败 %d" % (pool.metrics.docs - len(failures), len(failures))
+        print pool.metrics.report(0)
+    for pdf in manifest.orphans(files):
+        print u"源文件已删除：", pdf
+    manifest.save()
+    print u"未修改跳过：%d" % skipped[0]
+
 if __name__=='__main__':
-    main('F:\\template\\', 'F:\\record\\')
+    parser = argparse.ArgumentParser(description=u'批量将 Word 文档转换为 PDF')
+    parser.add_argument('src', nargs='?', default='F:\\template\\')
+    parser.add_argument('dest', nargs='?', default='F:\\record\\')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='word' if sys.platform == 'win32' else 'libreoffice',
+                        help=u'转换后端：word（Windows）、libreoffice（headless）或 stub（测试用）')
+    parser.add_argument('--workers', type=int, default=1, help=u'常驻转换器数量，默认 1')
+    parser.add_argument('--queue-size', type=int, help=u'遍历与转换之间的队列长度，默认为转换器数量的 4 倍')
+    parser.add_argument('--progress-interval', type=float, default=10, help=u'打印统计的间隔秒数，0 表示不打印，默认 10')
+    args = parser.parse_args()
+    main(args.src, args.dest, args.backend, args.workers, args.queue_size, args.progress_interval)
@@ -1,37 +1,436 @@
 import os
+import json
 import hashlib
-from collections import defaultdict
+import sqlite3
+import argparse
+import tempfile
+from collections import defaultdict, namedtuple
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-def get_file_hash(filepath):
-    """计算文件的 MD5 哈希值"""
-    hash_md5 = hashlib.md5()
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 相似图片检测需要 numpy 和 Pillow
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = Image = None
+
+# 部分哈希读取文件开头和结尾各这么多字节
+PARTIAL_SIZE = 64 * 1024
+# 完整哈希每次读取的字节数
+BUFFER_SIZE = 1024 * 1024
+# 低内存模式下每批从临时数据库取出的文件数
+CHUNK_SIZE = 10000
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+# 各感知哈希缩放后的图片尺寸 (宽, 高)，都得到 64 位哈希
+PHASH_SIZES = {"ahash": (8, 8), "dhash": (9, 8), "phash": (32, 32)}
+
+ALGORITHMS = ["md5", "sha1", "sha256", "blake2b"] + (["xxh64", "xxh3_128"] if xxhash else [])
+
+def new_hasher(algorithm):
+    """创建哈希对象，xxh64、xxh3_128 需要安装 xxhash"""
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError(f"算法 {algorithm} 需要先安装 xxhash：pip install xxhash")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+def get_file_hash(filepath, algorithm="md5", buffer_size=BUFFER_SIZE):
+    """计算文件的哈希值，默认 MD5"""
+    hasher = new_hasher(algorithm)
     with open(filepath, "rb") as f:
         # 分块读取文件，适合大文件
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        for chunk in iter(lambda: f.read(buffer_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
-def find_duplicate_files(directory):
-    """查找指定目录中的重复文件"""
-    # 存储文件哈希值与文件路径的映射
-    hash_dict = defaultdict(list)
-    
-    # 遍历目录
+def get_partial_hash(filepath, size, partial_size=PARTIAL_SIZE, algorithm="md5", buffer_size=BUFFER_SIZE):
+    """计算文件首尾各 partial_size 字节的哈希，文件不超过 2 * partial_size 时就是整个文件的哈希"""
+    if size <= 2 * partial_size:
+        return get_file_hash(filepath, algorithm, buffer_size)
+    hasher = new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        hasher.update(f.read(partial_size))
+        f.seek(-partial_size, os.SEEK_END)
+        hasher.update(f.read(partial_size))
+    return hasher.hexdigest()
+
+class HashCache:
+    """以 (设备号, inode, 大小, mtime_ns) 为键的 SQLite 哈希缓存，文件没有变化时不必重新读取"""
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, kind TEXT, hash TEXT, path TEXT, "
+            "PRIMARY KEY (dev, ino, kind))"
+        )
+        self.pending = 0
+
+    def get(self, st, kind):
+        row = self.conn.execute(
+            "SELECT hash FROM hashes WHERE dev = ? AND ino = ? AND kind = ? AND size = ? AND mtime_ns = ?",
+            (st.st_dev, st.st_ino, kind, st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, st, kind, hash_val, filepath):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, kind, hash_val, filepath),
+        )
+        self.pending += 1
+        if self.pending >= self.COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def prune(self):
+        """删除已不存在或已被其他文件替换的条目，返回删除的文件数"""
+        stale = []
+        for dev, ino, path in self.conn.execute("SELECT DISTINCT dev, ino, path FROM hashes").fetchall():
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((dev, ino))
+                continue
+            if (st.st_dev, st.st_ino) != (dev, ino):
+                stale.append((dev, ino))
+        self.conn.executemany("DELETE FROM hashes WHERE dev = ? AND ino = ?", stale)
+        self.conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def hash_files(jobs, cache=None, workers=1):
+    """用线程池计算一批哈希（hashlib 读文件和计算时会释放 GIL）
+
+    jobs 为 (路径, stat 结果, 缓存类别, compute) 列表，compute() 读取文件返回哈希；
+    返回与 jobs 一一对应的哈希列表，无法读取的文件为 None。缓存只在调用线程中访问
+    """
+    results = [None] * len(jobs)
+    misses = []
+    for i, (filepath, st, kind, compute) in enumerate(jobs):
+        hash_val = cache.get(st, kind) if cache is not None else None
+        if hash_val is None:
+            misses.append(i)
+        else:
+            results[i] = hash_val
+
+    def run(i):
+        try:
+            return jobs[i][3]()
+        except (IOError, PermissionError) as e:
+            print(f"无法访问文件 {jobs[i][0]}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, hash_val in zip(misses, executor.map(run, misses)):
+            results[i] = hash_val
+            if hash_val is not None and cache is not None:
+                filepath, st, kind, _ = jobs[i]
+                cache.put(st, kind, hash_val, filepath)
+    return results
+
+def group_by_size(directory):
+    """按文件大小分组，只保留大小相同的文件不止一个的组，组内为 (路径, stat 结果)"""
+    size_dict = defaultdict(list)
     for root, _, files in os.walk(directory):
         for filename in files:
             filepath = os.path.join(root, filename)
             try:
-                # 获取文件的哈希值
-                file_hash = get_file_hash(filepath)
-                # 将文件路径添加到对应的哈希值列表中
-                hash_dict[file_hash].append(filepath)
-            except (IOError, PermissionError) as e:
+                st = os.stat(filepath)
+            except OSError as e:
                 print(f"无法访问文件 {filepath}: {e}")
-    
+                continue
+            size_dict[st.st_size].append((filepath, st))
+    return {size: entries for size, entries in size_dict.items() if len(entries) > 1}
+
+def find_duplicate_files(directory, partial_size=PARTIAL_SIZE, cache=None, algorithm="md5", workers=1,
+                         buffer_size=BUFFER_SIZE):
+    """查找指定目录中的重复文件
+
+    依次按文件大小、首尾部分哈希、完整哈希筛选，只有前一步仍然相同的文件才进入下一步，
+    大小唯一的文件不会被读取；每一步的哈希由 workers 个线程并行计算，
+    传入 HashCache 时未变化的文件直接使用缓存的哈希
+    """
+    # 存储文件哈希值与文件路径的映射
+    hash_dict = defaultdict(list)
+    # 小文件的部分哈希就是完整哈希，缓存时按完整哈希记录
+    full_kind = algorithm
+    partial_kind = f"{algorithm}:{partial_size}"
+
+    # 按首尾部分哈希细分大小相同的文件
+    jobs = []
+    for size, entries in group_by_size(directory).items():
+        kind = full_kind if size <= 2 * partial_size else partial_kind
+        for filepath, st in entries:
+            compute = partial(get_partial_hash, filepath, size, partial_size, algorithm, buffer_size)
+            jobs.append((filepath, st, kind, compute))
+    partial_dict = defaultdict(list)
+    for (filepath, st, _, _), partial_hash in zip(jobs, hash_files(jobs, cache, workers)):
+        if partial_hash is not None:
+            partial_dict[(st.st_size, partial_hash)].append((filepath, st))
+
+    # 部分哈希仍然相同的文件再计算完整哈希
+    jobs = []
+    for (size, partial_hash), candidates in partial_dict.items():
+        if len(candidates) < 2:
+            continue
+        if size <= 2 * partial_size:
+            # 部分哈希已经覆盖整个文件
+            hash_dict[partial_hash].extend(filepath for filepath, st in candidates)
+            continue
+        for filepath, st in candidates:
+            jobs.append((filepath, st, full_kind, partial(get_file_hash, filepath, algorithm, buffer_size)))
+    for (filepath, _, _, _), hash_val in zip(jobs, hash_files(jobs, cache, workers)):
+        if hash_val is not None:
+            hash_dict[hash_val].append(filepath)
+
     # 筛选出重复的文件（哈希值对应多个文件路径）
     duplicates = {hash_val: paths for hash_val, paths in hash_dict.items() if len(paths) > 1}
     return duplicates
 
+# 低内存模式下从临时数据库恢复出的 stat 信息，供 HashCache 使用
+FileStat = namedtuple("FileStat", "st_dev st_ino st_size st_mtime_ns")
+
+def _hash_rows(conn, rows, table, kind_of, compute_of, cache, workers):
+    """计算一批 (id, 路径, 大小, dev, ino, mtime_ns) 的哈希，写入 table"""
+    jobs = []
+    for file_id, filepath, size, dev, ino, mtime_ns in rows:
+        jobs.append((filepath, FileStat(dev, ino, size, mtime_ns), kind_of(size), compute_of(filepath, size)))
+    conn.executemany(
+        f"INSERT INTO {table} VALUES (?, ?, ?)",
+        [(row[0], row[2], hash_val) for row, hash_val in zip(rows, hash_files(jobs, cache, workers))
+         if hash_val is not None],
+    )
+
+def stream_duplicate_files(directory, out, partial_size=PARTIAL_SIZE, cache=None, algorithm="md5", workers=1,
+                           buffer_size=BUFFER_SIZE, spill_dir=None):
+    """内存占用固定的查找方式，适合上千万文件的目录
+
+    与 find_duplicate_files 的筛选步骤相同，但文件列表和分组状态都放在 spill_dir 下的临时 SQLite
+    数据库中，每次只取 CHUNK_SIZE 个文件；重复文件组按 NDJSON 逐行写入 out，
+    每行为 {"hash", "size", "total_size", "files"}，大小取自扫描时的 stat。返回重复文件组数
+    """
+    full_kind = algorithm
+    partial_kind = f"{algorithm}:{partial_size}"
+    with tempfile.TemporaryDirectory(prefix="find_duplicates_", dir=spill_dir) as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "groups.db"))
+        try:
+            conn.execute("PRAGMA temp_store = FILE")
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT, size INTEGER, "
+                         "dev INTEGER, ino INTEGER, mtime_ns INTEGER)")
+            conn.execute("CREATE TABLE partials (id INTEGER PRIMARY KEY, size INTEGER, hash TEXT)")
+            conn.execute("CREATE TABLE fulls (id INTEGER PRIMARY KEY, size INTEGER, hash TEXT)")
+
+            # 扫描目录，分批写入文件信息
+            batch = []
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    filepath = os.path.join(root, filename)
+                    try:
+                        st = os.stat(filepath)
+                    except OSError as e:
+                        print(f"无法访问文件 {filepath}: {e}")
+                        continue
+                    batch.append((filepath, st.st_size, st.st_dev, st.st_ino, st.st_mtime_ns))
+                    if len(batch) >= CHUNK_SIZE:
+                        conn.executemany("INSERT INTO files (path, size, dev, ino, mtime_ns) VALUES (?, ?, ?, ?, ?)", batch)
+                        batch = []
+            conn.executemany("INSERT INTO files (path, size, dev, ino, mtime_ns) VALUES (?, ?, ?, ?, ?)", batch)
+            conn.execute("CREATE INDEX files_size ON files (size)")
+
+            # 大小相同的文件计算首尾部分哈希
+            cursor = conn.execute(
+                "SELECT f.id, f.path, f.size, f.dev, f.ino, f.mtime_ns FROM files f "
+                "JOIN (SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1) d ON f.size = d.size"
+            )
+            for rows in iter(lambda: cursor.fetchmany(CHUNK_SIZE), []):
+                _hash_rows(conn, rows, "partials",
+                           lambda size: full_kind if size <= 2 * partial_size else partial_kind,
+                           lambda filepath, size: partial(get_partial_hash, filepath, size, partial_size,
+                                                          algorithm, buffer_size),
+                           cache, workers)
+            conn.execute("CREATE INDEX partials_hash ON partials (size, hash)")
+
+            # 部分哈希已覆盖整个文件的小文件直接作为完整哈希，其余仍相同的文件计算完整哈希
+            conn.execute("INSERT INTO fulls SELECT id, size, hash FROM partials WHERE size <= ?", (2 * partial_size,))
+            cursor = conn.execute(
+                "SELECT f.id, f.path, f.size, f.dev, f.ino, f.mtime_ns FROM partials p "
+                "JOIN (SELECT size, hash FROM partials WHERE size > ? GROUP BY size, hash HAVING COUNT(*) > 1) d "
+                "ON p.size = d.size AND p.hash = d.hash JOIN files f ON f.id = p.id",
+                (2 * partial_size,),
+            )
+            for rows in iter(lambda: cursor.fetchmany(CHUNK_SIZE), []):
+                _hash_rows(conn, rows, "fulls", lambda size: full_kind,
+                           lambda filepath, size: partial(get_file_hash, filepath, algorithm, buffer_size),
+                           cache, workers)
+            conn.execute("CREATE INDEX fulls_hash ON fulls (hash)")
+
+            # 按哈希排序后逐组输出
+            cursor = conn.execute(
+                "SELECT h.hash, f.size, f.path FROM fulls h "
+                "JOIN (SELECT hash FROM fulls GROUP BY hash HAVING COUNT(*) > 1) d ON h.hash = d.hash "
+                "JOIN files f ON f.id = h.id ORDER BY h.hash"
+            )
+            groups = 0
+            for hash_val, rows in groupby(cursor, key=lambda row: row[0]):
+                rows = list(rows)
+                record = {"hash": hash_val, "size": rows[0][1], "total_size": sum(row[1] for row in rows),
+                          "files": [row[2] for row in rows]}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                groups += 1
+            return groups
+        finally:
+            conn.close()
+
+def _load_gray(filepath, size):
+    """读取图片并缩放成 size 大小的灰度数组，无法读取时返回 None"""
+    try:
+        with Image.open(filepath) as img:
+            # JPEG 解码时直接按比例缩小，省去大部分解码开销
+            img.draft("L", (size[0] * 4, size[1] * 4))
+            return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"无法读取图片 {filepath}: {e}")
+        return None
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+def perceptual_hashes(pixels, method="dhash"):
+    """批量计算 64 位感知哈希，pixels 为 (图片数, 高, 宽) 的灰度数组，返回 uint64 数组"""
+    n = len(pixels)
+    if method == "ahash":
+        bits = pixels > pixels.mean(axis=(1, 2), keepdims=True)
+    elif method == "dhash":
+        bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    elif method == "phash":
+        d = _dct_matrix(pixels.shape[1])
+        low = (d @ pixels @ d.T)[:, :8, :8].reshape(n, 64)
+        # 与去掉直流分量后的中位数比较
+        bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    else:
+        raise ValueError(f"未知的感知哈希算法：{method}")
+    return np.packbits(bits.reshape(n, 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+def compute_image_hashes(filepaths, method="dhash", batch_size=256, workers=1):
+    """分批读取图片并计算感知哈希，返回 (能读取的图片路径列表, 对应的 uint64 哈希数组)"""
+    size = PHASH_SIZES[method]
+    paths, hashes = [], []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(filepaths), batch_size):
+            batch = filepaths[start:start + batch_size]
+            loaded = [(p, a) for p, a in zip(batch, executor.map(partial(_load_gray, size=size), batch))
+                      if a is not None]
+            if loaded:
+                paths.extend(p for p, a in loaded)
+                hashes.append(perceptual_hashes(np.stack([a for p, a in loaded]), method))
+    return paths, (np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64))
+
+def _popcount(x):
+    return np.unpackbits(x.view(np.uint8).reshape(x.shape + (8,)), axis=-1).sum(axis=-1)
+
+def find_similar_pairs(hashes, threshold=4, bands=None):
+    """用 LSH 分桶找出汉明距离不超过 threshold 的哈希对，返回 (对数, 2) 的下标数组
+
+    64 位哈希切成 bands 段，只比较至少有一段完全相同的哈希；bands 默认为 threshold + 1，
+    此时距离不超过 threshold 的两个哈希必有一段相同，不会漏掉
+    """
+    bands = min(64, bands or threshold + 1)
+    widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+    band_values = np.empty((len(hashes), bands), dtype=np.uint64)
+    shift = 0
+    for k, width in enumerate(widths):
+        band_values[:, k] = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+
+    pairs = []
+    for k in range(bands):
+        order = np.argsort(band_values[:, k], kind="stable")
+        values = band_values[order, k]
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        ends = np.r_[starts[1:], len(values)]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            bucket = order[start:end]
+            # 大桶分块比较，限制一次生成的距离矩阵大小
+            block = max(1, (1 << 20) // len(bucket))
+            for row in range(0, len(bucket), block):
+                rows = bucket[row:row + block]
+                i, j = np.nonzero(_popcount(hashes[rows][:, None] ^ hashes[bucket][None, :]) <= threshold)
+                a, b = rows[i], bucket[j]
+                keep = a < b
+                a, b = a[keep], b[keep]
+                if k:
+                    # 在前面某一段已经同桶的对已经比较过
+                    seen = (band_values[a, :k] == band_values[b, :k]).any(axis=1)
+                    a, b = a[~seen], b[~seen]
+                if len(a):
+                    pairs.append(np.stack([a, b], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+def group_pairs(pairs):
+    """把相似对合并成组（并查集），返回下标列表的列表"""
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs.tolist():
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+    groups = defaultdict(list)
+    for x in parent:
+        groups[find(x)].append(x)
+    return [sorted(members) for members in groups.values()]
+
+def find_near_duplicate_images(directory, method="dhash", threshold=4, bands=None, batch_size=256, workers=1):
+    """查找缩放、重新压缩等产生的相似图片，返回图片路径组的列表"""
+    if np is None:
+        raise RuntimeError("相似图片检测需要先安装 numpy 和 Pillow：pip install numpy pillow")
+    filepaths = []
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                filepaths.append(os.path.join(root, filename))
+    paths, hashes = compute_image_hashes(filepaths, method, batch_size, workers)
+    groups = group_pairs(find_similar_pairs(hashes, threshold, bands))
+    return [[paths[i] for i in group] for group in groups]
+
+def print_near_duplicates(groups):
+    """打印相似图片组"""
+    if not groups:
+        print("没有找到相似图片。")
+        return
+
+    print("找到以下相似图片：")
+    for n, group in enumerate(groups, 1):
+        print(f"\n第 {n} 组：")
+        for filepath in group:
+            print(f"  文件: {filepath}")
+
 def print_duplicates(duplicates):
     """打印重复文件的信息"""
     if not duplicates:
@@ -49,16 +448,54 @@ def print_duplicates(duplicates):
         print(f"  总大小: {total_size / 1024:.2f} KB")
 
 def main():
+    parser = argparse.ArgumentParser(description="查找目录中的重复文件")
+    parser.add_argument("directory", nargs="?", help="要扫描的目录，不指定则交互输入")
+    parser.add_argument("--cache", help="SQLite 哈希缓存文件，未变化的文件不再重新读取")
+    parser.add_argument("--prune", action="store_true", help="扫描前清理缓存中已不存在的文件")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="md5", help="哈希算法（默认 md5）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行计算哈希的线程数（默认 CPU 核数）")
+    parser.add_argument("--buffer-kb", type=int, default=BUFFER_SIZE // 1024, help="每次读取的大小，单位 KB（默认 1024）")
+    parser.add_argument("--ndjson", metavar="FILE", help="低内存模式：分组状态写入磁盘，重复文件组以 NDJSON 逐行写入 FILE")
+    parser.add_argument("--spill-dir", help="低内存模式下临时数据库所在目录（默认系统临时目录）")
+    parser.add_argument("--similar-images", action="store_true", help="查找相似图片（缩放、重新压缩等），需要 numpy 和 Pillow")
+    parser.add_argument("--phash", choices=sorted(PHASH_SIZES), default="dhash", help="感知哈希算法（默认 dhash）")
+    parser.add_argument("--threshold", type=int, default=4, help="相似图片允许的最大汉明距离（默认 4）")
+    parser.add_argument("--bands", type=int, help="LSH 分段数，默认为 threshold + 1")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批计算感知哈希的图片数（默认 256）")
+    args = parser.parse_args()
+
     # 获取用户输入的目录
-    directory = input("请输入要扫描的目录路径（例如 C:/Users/YourName/Documents）：")
+    directory = args.directory or input("请输入要扫描的目录路径（例如 C:/Users/YourName/Documents）：")
     
     # 验证目录是否存在
     if not os.path.isdir(directory):
         print("错误：指定的目录不存在！")
         return
     
-    print(f"正在扫描目录：{directory}")
-    duplicates = find_duplicate_files(directory)
+    if args.similar_images:
+        print(f"正在扫描目录：{directory}")
+        groups = find_near_duplicate_images(directory, args.phash, args.threshold, args.bands, args.batch_size,
+                                            args.workers)
+        print_near_duplicates(groups)
+        return
+
+    cache = HashCache(args.cache) if args.cache else None
+    try:
+        if cache is not None and args.prune:
+            print(f"已清理 {cache.prune()} 个失效的缓存条目")
+        print(f"正在扫描目录：{directory}")
+        if args.ndjson:
+            with open(args.ndjson, "w", encoding="utf-8") as out:
+                groups = stream_duplicate_files(directory, out, cache=cache, algorithm=args.algorithm,
+                                                workers=args.workers, buffer_size=args.buffer_kb * 1024,
+                                                spill_dir=args.spill_dir)
+            print(f"找到 {groups} 组重复文件，已写入 {args.ndjson}")
+            return
+        duplicates = find_duplicate_files(directory, cache=cache, algorithm=args.algorithm, workers=args.workers,
+                                          buffer_size=args.buffer_kb * 1024)
+    finally:
+        if cache is not None:
+            cache.close()
     print_duplicates(duplicates)
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
 import smtplib
+import socket
+import queue
+import threading
+import argparse
 import csv
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
@@ -22,25 +28,172 @@ def load_customer_data(csv_file):
         print(f"读取 CSV 文件时出错：{e}")
         return []
 
-def create_email_content(customer, template_file):
-    """创建个性化邮件内容"""
-    try:
-        with open(template_file, 'r', encoding='utf-8') as file:
-            template = file.read()
-        # 替换模板中的占位符
-        template = template.replace('{Name}', customer['Name'])
-        template = template.replace('{Company}', customer['Company'])
-        template = template.replace('{Date}', datetime.now().strftime('%Y-%m-%d'))
-        return template
-    except FileNotFoundError:
-        print(f"错误：找不到模板文件 {template_file}")
+# 模板占位符：{列名}，列名只能是字母、数字和下划线，这样 CSS 中的 { color: red } 不会被当成占位符
+PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+class EmailTemplate:
+    """编译后的邮件模板
+
+    加载时切分成文字片段和占位符，渲染时按占位符取值后一次 join，不需要反复扫描整个模板。
+    CSV 的任意列都可以作为占位符，{Date} 默认是当天日期（CSV 中有 Date 列时以 CSV 为准）
+    """
+
+    def __init__(self, text):
+        self.literals = []
+        self.names = []
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            self.literals.append(text[pos:match.start()])
+            self.names.append(match.group(1))
+            pos = match.end()
+        self.literals.append(text[pos:])
+        self.defaults = {'Date': datetime.now().strftime('%Y-%m-%d')}
+
+    @classmethod
+    def load(cls, template_file):
+        """读取并编译模板文件，失败返回 None"""
+        try:
+            with open(template_file, 'r', encoding='utf-8') as file:
+                return cls(file.read())
+        except FileNotFoundError:
+            print(f"错误：找不到模板文件 {template_file}")
+        except Exception as e:
+            print(f"处理模板文件时出错：{e}")
+        return None
+
+    def missing_fields(self, columns):
+        """模板中用到、但 CSV 列和默认值都不提供的占位符"""
+        return sorted(set(self.names) - set(columns) - set(self.defaults))
+
+    def render(self, values):
+        parts = [None] * (2 * len(self.names) + 1)
+        parts[::2] = self.literals
+        parts[1::2] = [(values[name] if name in values else self.defaults[name]) or '' for name in self.names]
+        return ''.join(parts)
+
+def create_email_content(customer, template):
+    """创建个性化邮件内容，template 是 EmailTemplate.load 得到的编译后模板"""
+    return template.render(customer)
+
+class SMTPPool:
+    """一组保持登录状态的 SMTP 连接，供多个发送线程共用
+
+    每个线程发送时从池中取出一个空闲连接，发完放回，邮件自然分散到各个连接上；
+    连接被服务器断开时自动重连并重发。本地调试可以指向不需要 TLS 和登录的测试服务器，
+    例如 pip install aiosmtpd 后运行 python -m aiosmtpd -n -l localhost:1025
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=3, use_ssl=True, starttls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connects = 0
+        self.lock = threading.Lock()
+        # 空闲连接队列，None 表示还没有建立（或已断开需要重建）的连接
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(None)
+
+    def connect(self):
+        """建立一个新连接并登录"""
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self.lock:
+            self.connects += 1
+        return server
+
+    def open(self):
+        """预先建立所有连接，认证失败等问题在开始发送前就能发现"""
+        servers = [self.idle.get() for _ in range(self.size)]
+        try:
+            for i, server in enumerate(servers):
+                if server is None:
+                    servers[i] = self.connect()
+        finally:
+            for server in servers:
+                self.idle.put(server)
+
+    @staticmethod
+    def is_disconnect(error):
+        """连接层面的错误：断开、超时，或服务器返回 421 关闭连接"""
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421
+        return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout))
+
+    def send(self, msg, retries=2):
+        """用一个空闲连接发送邮件，连接断开时重连后重发，最多重试 retries 次"""
+        server = self.idle.get()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    if server is None:
+                        server = self.connect()
+                    server.send_message(msg)
+                    return
+                except Exception as e:
+                    if not self.is_disconnect(e):
+                        raise
+                    self.discard(server)
+                    server = None
+                    if attempt == retries:
+                        raise
+        finally:
+            self.idle.put(server)
+
+    @staticmethod
+    def discard(server):
+        if server is None:
+            return
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """退出并关闭池中的所有连接"""
+        for _ in range(self.size):
+            server = self.idle.get()
+            if server is not None:
+                try:
+                    server.quit()
+                except Exception:
+                    self.discard(server)
+            self.idle.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_attachment(attachment_path):
+    """读取附件，返回 (文件名, 内容)；整个发送过程只读一次"""
+    if not attachment_path or not os.path.exists(attachment_path):
         return None
+    try:
+        with open(attachment_path, 'rb') as file:
+            return os.path.basename(attachment_path), file.read()
     except Exception as e:
-        print(f"处理模板文件时出错：{e}")
+        print(f"读取附件 {attachment_path} 时出错：{e}")
         return None
 
-def send_email(sender_email, app_password, customer, subject, html_content, attachment_path=None):
-    """发送邮件"""
+def send_email(pool, sender_email, customer, subject, html_content, attachment=None):
+    """通过连接池发送邮件，attachment 是 load_attachment 返回的 (文件名, 内容)"""
     msg = MIMEMultipart()
     msg['From'] = sender_email
     msg['To'] = customer['Email']
@@ -50,27 +203,32 @@ def send_email(sender_email, app_password, customer, subject, html_content, atta
     msg.attach(MIMEText(html_content, 'html'))
 
     # 添加附件（如果有）
-    if attachment_path and os.path.exists(attachment_path):
-        try:
-            with open(attachment_path, 'rb') as file:
-                part = MIMEApplication(file.read(), Name=os.path.basename(attachment_path))
-                part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-                msg.attach(part)
-        except Exception as e:
-            print(f"添加附件 {attachment_path} 时出错：{e}")
+    if attachment:
+        name, data = attachment
+        part = MIMEApplication(data, Name=name)
+        part['Content-Disposition'] = f'attachment; filename="{name}"'
+        msg.attach(part)
 
-    # 连接到 SMTP 服务器
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, app_password)
-            server.send_message(msg)
-            print(f"成功发送邮件到 {customer['Email']}")
+        pool.send(msg)
+        print(f"成功发送邮件到 {customer['Email']}")
+        return True
     except smtplib.SMTPAuthenticationError:
         print("认证失败，请检查邮箱和应用专用密码")
     except Exception as e:
         print(f"发送邮件到 {customer['Email']} 时出错：{e}")
+    return False
 
 def main():
+    parser = argparse.ArgumentParser(description="批量发送个性化邮件")
+    parser.add_argument("--smtp-host", default="smtp.gmail.com", help="SMTP 服务器（默认 smtp.gmail.com）")
+    parser.add_argument("--smtp-port", type=int, default=465, help="SMTP 端口（默认 465）")
+    parser.add_argument("--no-ssl", action="store_true", help="使用明文 SMTP 连接，用于本地调试服务器")
+    parser.add_argument("--starttls", action="store_true", help="明文连接后用 STARTTLS 升级（如 587 端口）")
+    parser.add_argument("--no-login", action="store_true", help="不登录，用于不需要认证的本地调试服务器")
+    parser.add_argument("--connections", type=int, default=3, help="同时保持的 SMTP 连接数（默认 3）")
+    args = parser.parse_args()
+
     # 配置信息
     sender_email = os.getenv('GMAIL_ADDRESS')  # 从环境变量获取邮箱
     app_password = os.getenv('GMAIL_APP_PASSWORD')  # 从环境变量获取应用专用密码
@@ -80,7 +238,7 @@ def main():
     subject = 'Energy Storage Solutions for Your Business'
 
     # 验证环境变量
-    if not sender_email or not app_password:
+    if not sender_email or (not app_password and not args.no_login):
         print("错误：请设置环境变量 GMAIL_ADDRESS 和 GMAIL_APP_PASSWORD")
         print("运行以下命令设置环境变量：")
         print("export GMAIL_ADDRESS='your_email@gmail.com'")
@@ -93,11 +251,38 @@ def main():
         print("没有客户数据可处理")
         return
 
-    # 发送邮件
-    for customer in customers:
-        html_content = create_email_content(customer, template_file)
-        if html_content:
-            send_email(sender_email, app_password, customer, subject, html_content, attachment_path)
+    # 模板只加载和编译一次，缺少的列在发送前检查
+    template = EmailTemplate.load(template_file)
+    if template is None:
+        return
+    missing = template.missing_fields(customers[0].keys())
+    if missing:
+        print(f"错误：模板中的占位符 {', '.join('{' + name + '}' for name in missing)} 在 {csv_file} 中没有对应的列")
+        return
+
+    pool = SMTPPool(args.smtp_host, args.smtp_port, sender_email, None if args.no_login else app_password,
+                    size=args.connections, use_ssl=not args.no_ssl, starttls=args.starttls)
+    try:
+        pool.open()
+    except smtplib.SMTPAuthenticationError:
+        print("认证失败，请检查邮箱和应用专用密码")
+        pool.close()
+        return
+    except Exception as e:
+        print(f"连接 SMTP 服务器 {args.smtp_host}:{args.smtp_port} 失败：{e}")
+        pool.close()
+        return
+
+    attachment = load_attachment(attachment_path)
+
+    def send_to(customer):
+        html_content = create_email_content(customer, template)
+        return send_email(pool, sender_email, customer, subject, html_content, attachment)
+
+    # 发送邮件：每个连接对应一个发送线程
+    with pool, ThreadPoolExecutor(max_workers=args.connections) as executor:
+        sent = sum(executor.map(send_to, customers))
+    print(f"发送完成：{sent}/{len(customers)} 封成功，共建立 {pool.connects} 次 SMTP 连接")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,160 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from openpyxl import Workbook
 
-def get_json(url, page, lang_name):
+URL = 'http://www.lagou.com/jobs/positionAjax.json?needAddtionalResult=false'
+PAGES = 30
+COLUMNS = ['companyShortName', 'companyName', 'salary', 'city', 'education']
+
+
+class ResponseCache:
+    """按 (url, page, keyword) 缓存接口响应的磁盘缓存，ttl 为 None 时永不过期"""
+
+    def __init__(self, path, ttl=None, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url, page, lang_name, city=None):
+        parts = [url, page, lang_name] if city is None else [url, page, lang_name, city]
+        key = json.dumps(parts, ensure_ascii=False)
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url, page, lang_name, city=None):
+        """返回缓存的响应，不存在或已过期时返回 None；离线模式下不检查过期"""
+        try:
+            with open(self._file(url, page, lang_name, city), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self.offline and self.ttl is not None and time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['response']
+
+    def put(self, url, page, lang_name, response, city=None):
+        path = self._file(url, page, lang_name, city)
+        tmp = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.time(), 'response': response}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+class TokenBucket:
+    """令牌桶限速：平均每秒 rate 个请求，最多突发 capacity 个，可跨线程共享"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cancelled=None):
+        """取一个令牌，返回 True；等待期间 cancelled() 变为真时放弃等待，返回 False"""
+        while True:
+            if cancelled is not None and cancelled():
+                return False
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(min(wait, 0.1) if cancelled is not None else wait)
+
+
+class PageBound:
+    """一个任务内各请求线程共享的页码上限：某页没有结果之后，更靠后的页不再请求"""
+
+    def __init__(self):
+        self.last = None
+        self.lock = threading.Lock()
+
+    def stop_at(self, page):
+        with self.lock:
+            if self.last is None or page < self.last:
+                self.last = page
+
+    def beyond(self, page):
+        return self.last is not None and page > self.last
+
+
+def position_result(response):
+    """取出一页响应中的职位列表；限流、反爬等没有职位列表的响应抛出 ValueError"""
+    try:
+        return response['content']['positionResult']['result']
+    except (KeyError, TypeError):
+        msg = response.get('msg') if isinstance(response, dict) else None
+        raise ValueError('响应中没有职位数据（可能被限流或反爬）：%s' % (msg or str(response)[:200]))
+
+
+def cached_response(cache, url, page, lang_name, city=None):
+    """缓存中可用的响应；没有缓存，或是旧版本缓存下来的限流等异常响应时返回 None"""
+    response = cache.get(url, page, lang_name, city)
+    if response is None:
+        return None
+    try:
+        position_result(response)
+    except ValueError:
+        return None
+    return response
+
+
+def fetch_json(url, page, lang_name, session=requests, cache=None, city=None, limiter=None, bound=None):
+    """请求一页数据；有 cache 时优先读缓存，离线模式下只读缓存；真正发请求前先向 limiter 取令牌
+
+    只有带职位列表的响应才写入缓存，限流等异常响应抛出 ValueError，不会被缓存；
+    页码已超出 bound（前面已有空页）时不取令牌也不发请求，返回 None
+    """
+    if cache is not None:
+        response = cached_response(cache, url, page, lang_name, city)
+        if response is not None:
+            return response
+        if cache.offline:
+            raise LookupError('离线模式下缓存中没有 %s 第 %d 页' % (lang_name, page))
+    skipped = (lambda: bound.beyond(page)) if bound is not None else None
+    if limiter is not None and not limiter.acquire(skipped):
+        return None
+    if skipped is not None and skipped():
+        return None
     data = {'first': 'true', 'pn': page, 'kd': lang_name}
-    json = requests.post(url, data).json()
-    list_con = json['content']['positionResult']['result']
+    params = {'city': city} if city else None
+    response = session.post(url, data, params=params).json()
+    position_result(response)
+    if cache is not None:
+        cache.put(url, page, lang_name, response, city)
+    return response
+
+
+def get_json(url, page, lang_name, session=requests, cache=None, city=None, limiter=None, bound=None):
+    json = fetch_json(url, page, lang_name, session, cache, city, limiter, bound)
+    if json is None:
+        return []
+    list_con = position_result(json)
+    if bound is not None:
+        if not list_con:
+            bound.stop_at(page)
+        else:
+            # 响应里带有总数和每页条数时，直接算出最后一页
+            total = json['content']['positionResult'].get('totalCount')
+            page_size = json['content'].get('pageSize')
+            if total is not None and page_size:
+                bound.stop_at(max(-(-int(total) // int(page_size)), 1))
     info_list = []
     for i in list_con:
         info = []
@@ -17,21 +167,227 @@ def get_json(url, page, lang_name):
     return info_list
 
 
+def make_session(pool_size):
+    """创建连接池大小为 pool_size 的会话，各页复用 TCP/TLS 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def iter_pages(url, lang_name, pages, concurrency=8, cache=None, city=None, limiter=None):
+    """最多 concurrency 个请求并发抓取 pages，按页码顺序逐页产出结果
+
+    某页没有结果后，已提交但还没发出的后续页直接跳过，不再占用令牌和请求
+    """
+    bound = PageBound()
+    with make_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        try:
+            for page in pages:
+                if bound.beyond(page):
+                    break
+                # 在这里按页码顺序取令牌，而不是在各线程里抢，避免靠后的页先于前面的页发出请求
+                if limiter is not None and (cache is None or not cache.offline and
+                                            cached_response(cache, url, page, lang_name, city) is None):
+                    if not limiter.acquire(lambda: bound.beyond(page)):
+                        break
+                pending.append(executor.submit(get_json, url, page, lang_name, session, cache, city, None, bound))
+                if len(pending) >= concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 提前停止时取消还未开始的请求
+            for future in pending:
+                future.cancel()
+
+
+class Sink(ABC):
+    """结果输出，逐页写出，不在内存中累积"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @abstractmethod
+    def write(self, lang_name, rows):
+        """写出一页结果，rows 是字段列表的列表"""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class XlsxSink(Sink):
+    """openpyxl 只写模式工作簿，每个职位名一个工作表"""
+
+    def __init__(self, path, append=False):
+        if append:
+            raise ValueError('xlsx 输出不支持断点续爬，请改用 .csv 或 .ndjson')
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.sheets = {}
+
+    def write(self, lang_name, rows):
+        if lang_name not in self.sheets:
+            self.sheets[lang_name] = self.wb.create_sheet(lang_name)
+        ws = self.sheets[lang_name]
+        for row in rows:
+            ws.append(row)
+
+    def close(self):
+        if not self.sheets:
+            self.wb.create_sheet()
+        self.wb.save(self.path)
+
+
+class CsvSink(Sink):
+    def __init__(self, path, append=False):
+        resume = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self.f = open(path, 'a' if resume else 'w', newline='', encoding='utf-8' if resume else 'utf-8-sig')
+        self.writer = csv.writer(self.f)
+        if not resume:
+            self.writer.writerow(['keyword'] + COLUMNS)
+
+    def write(self, lang_name, rows):
+        self.writer.writerows([lang_name] + row for row in rows)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class NdjsonSink(Sink):
+    def __init__(self, path, append=False):
+        self.f = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, lang_name, rows):
+        for row in rows:
+            record = dict(zip(COLUMNS, row), keyword=lang_name)
+            self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+SINKS = {'.xlsx': XlsxSink, '.csv': CsvSink, '.ndjson': NdjsonSink, '.jsonl': NdjsonSink}
+
+
+def open_sink(path, append=False):
+    """按扩展名选择输出格式，append 为 True 时接着已有文件写"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in SINKS:
+        raise ValueError('不支持的输出格式：%s（支持 %s）' % (ext, '、'.join(SINKS)))
+    return SINKS[ext](path, append)
+
+
+def load_jobs(path):
+    """读取任务列表，每行一个任务：职位名[,城市[,最多页数]]，# 开头的行为注释"""
+    jobs = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            row = [c.strip() for c in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            city = row[1] if len(row) > 1 and row[1] else None
+            pages = int(row[2]) if len(row) > 2 and row[2] else PAGES
+            jobs.append((row[0], city, pages))
+    return jobs
+
+
+class Checkpoint:
+    """记录每个任务已写出的最后一页，中断后从下一页继续"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+
+    @staticmethod
+    def _key(lang_name, city):
+        return '%s|%s' % (lang_name, city or '')
+
+    def get(self, lang_name, city):
+        return self.state.get(self._key(lang_name, city), {'page': 0, 'done': False})
+
+    def update(self, lang_name, city, page, done=False):
+        self.state[self._key(lang_name, city)] = {'page': page, 'done': done}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def run_jobs(url, jobs, sink, concurrency=8, cache=None, limiter=None, checkpoint=None):
+    """依次执行 (职位名, 城市, 最多页数) 任务，遇到没有结果的页即结束该任务；
+    每写完一页记录一次 checkpoint"""
+    for lang_name, city, pages in jobs:
+        state = checkpoint.get(lang_name, city) if checkpoint else {'page': 0, 'done': False}
+        if state['done']:
+            continue
+        page = state['page']
+        page_range = range(page + 1, pages + 1)
+        with closing(iter_pages(url, lang_name, page_range, concurrency, cache, city, limiter)) as results:
+            for page, info in zip(page_range, results):
+                if not info:
+                    break
+                sink.write(lang_name, info)
+                if checkpoint:
+                    sink.flush()
+                    checkpoint.update(lang_name, city, page)
+        if checkpoint:
+            checkpoint.update(lang_name, city, page, done=True)
+
+
+def crawl(url, keywords, sink, pages=PAGES, concurrency=8, cache=None, limiter=None):
+    """依次抓取每个职位名，每页结果解析后直接写入 sink"""
+    run_jobs(url, [(lang_name, None, pages) for lang_name in keywords], sink, concurrency, cache, limiter)
+
+
 def main():
-    lang_name = input('职位名：')
-    page = 1
-    url = 'http://www.lagou.com/jobs/positionAjax.json?needAddtionalResult=false'
-    info_result = []
-    while page < 31:
-        info = get_json(url, page, lang_name)
-        info_result = info_result + info
-        page += 1
-    wb = Workbook()
-    ws1 = wb.active
-    ws1.title = lang_name
-    for row in info_result:
-        ws1.append(row)
-    wb.save('职位信息.xlsx')
+    parser = argparse.ArgumentParser(description='拉勾网职位爬虫')
+    parser.add_argument('--url', default=URL, help='职位接口地址')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数（默认 8）')
+    parser.add_argument('--output', default='职位信息.xlsx', help='输出文件，支持 .xlsx/.csv/.ndjson（默认 职位信息.xlsx）')
+    parser.add_argument('--cache-dir', help='响应缓存目录，不指定则不缓存')
+    parser.add_argument('--cache-ttl', type=float, default=86400, help='缓存有效期（秒，默认 86400）')
+    parser.add_argument('--offline', action='store_true', help='离线模式：只用缓存的响应重放，不访问网络')
+    parser.add_argument('--job-file', help='批量任务列表，每行：职位名[,城市[,最多页数]]；不指定则交互输入职位名')
+    parser.add_argument('--rate', type=float, help='每秒最多请求数（令牌桶限速），不指定则不限速')
+    parser.add_argument('--burst', type=int, default=1, help='令牌桶容量，即允许的突发请求数（默认 1）')
+    parser.add_argument('--checkpoint', help='断点文件，中断后用同一文件重新运行即可续爬（需 .csv 或 .ndjson 输出）')
+    args = parser.parse_args()
+    if args.offline and not args.cache_dir:
+        parser.error('--offline 需要同时指定 --cache-dir')
+    if args.checkpoint and SINKS.get(os.path.splitext(args.output)[1].lower()) is XlsxSink:
+        # xlsx 只在结束时整体保存，中途中断会丢掉断点里已记为完成的页
+        parser.error('--checkpoint 不支持 .xlsx 输出，请用 --output 指定 .csv 或 .ndjson 文件')
+    cache = ResponseCache(args.cache_dir, args.cache_ttl, args.offline) if args.cache_dir else None
+    limiter = TokenBucket(args.rate, args.burst) if args.rate else None
+
+    if args.job_file:
+        jobs = load_jobs(args.job_file)
+    else:
+        keywords = [k.strip() for k in input('职位名（多个用逗号分隔）：').replace('，', ',').split(',') if k.strip()]
+        jobs = [(lang_name, None, PAGES) for lang_name in keywords]
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    resume = checkpoint is not None and bool(checkpoint.state)
+    with open_sink(args.output, append=resume) as sink:
+        run_jobs(args.url, jobs, sink, args.concurrency, cache, limiter, checkpoint)
 
 if __name__ == '__main__':
     main()
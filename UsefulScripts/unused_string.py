@@ -1,6 +1,11 @@
-import sys
 import os
 import re
+import io
+import mmap
+import fnmatch
+import sqlite3
+import multiprocessing
+import argparse
 
 
 def file_match(fname, pat):
@@ -9,10 +14,10 @@ def file_match(fname, pat):
 	except IOError:
 		return
 
-	for i, line in enumerate(f):
-		if pat.search(line):
-			return True
-	f.close()
+	with f:
+		for i, line in enumerate(f):
+			if pat.search(line):
+				return True
 	return False
 
 
@@ -26,11 +31,312 @@ def rgrep_match(dir_name, s_pat):
 				return match
 	return False
 
+def parse_strings_file(strings_file):
+	"""Return (key, line) pairs for every line of a Localizable.strings file."""
+	entries = []
+	with open(strings_file) as f:
+		for item in f:
+			grep_for = item.strip().split(' = ')[0].replace('"','')
+			entries.append((grep_for, item))
+	return entries
+
+
+def _trie_regex(node):
+	end = '' in node
+	alts = [re.escape(ch) + _trie_regex(node[ch]) for ch in sorted(node) if ch]
+	if not alts:
+		return ''
+	if len(alts) == 1 and not end:
+		return alts[0]
+	pat = '(?:%s)' % '|'.join(alts)
+	if end:
+		pat += '?'
+	return pat
+
+
+def _keys_regex(keys):
+	trie = {}
+	for key in keys:
+		node = trie
+		for ch in key:
+			node = node.setdefault(ch, {})
+		node[''] = True
+	return '(?=(%s))' % _trie_regex(trie)
+
+
+def build_keys_pattern(keys):
+	"""Compile all keys into one trie-shaped regex that reports, at every
+	position, the longest key starting there."""
+	return re.compile(_keys_regex(keys))
+
+
+def multi_match(dir_name, keys):
+	"""Return the set of keys referenced under dir_name.
+
+	Unlike rgrep_match every file is read only once and all keys are matched
+	together; keys are treated as literal strings, not regexes."""
+	pending = set(k for k in keys if k)
+	found = set()
+	if not pending:
+		return found
+	pat = build_keys_pattern(pending)
+	for dirpath, dirnames, filenames in os.walk(dir_name):
+		for fname in filenames:
+			try:
+				with open(os.path.join(dirpath, fname), "rt") as f:
+					content = f.read()
+			except IOError:
+				continue
+			for m in pat.finditer(content):
+				hit = m.group(1)
+				if hit in found:
+					continue
+				found.add(hit)
+				# shorter keys starting at the same offset are prefixes of hit
+				for i in range(1, len(hit)):
+					if hit[:i] in pending:
+						found.add(hit[:i])
+			if len(found) == len(pending):
+				return found
+	return found
+
+
+# string literal contents, or identifier-like words (R.string.foo, L10n.title)
+TOKEN_RE = re.compile(r'"((?:[^"\\\n]|\\.)*)"|([A-Za-z_][\w.]*)')
+# bump when the tokenization changes so existing index files are rebuilt
+INDEX_VERSION = 2
+
+
+def dotted_tokens(word):
+	"""Every contiguous run of components of a dotted chain, so that
+	R.string.localizable.hello matches the keys hello, localizable.hello,
+	string.localizable and so on, as well as the full chain."""
+	parts = [p for p in word.split('.') if p]
+	return set('.'.join(parts[i:j]) for i in range(len(parts)) for j in range(i + 1, len(parts) + 1))
+
+
+def _to_text(s):
+	if isinstance(s, bytes):
+		return s.decode('utf-8', 'replace')
+	return s
+
+
+def file_tokens(fname):
+	"""Return the set of string literals and words in fname, None if unreadable."""
+	try:
+		with io.open(fname, encoding='utf-8', errors='replace') as f:
+			content = f.read()
+	except IOError:
+		return None
+	tokens = set()
+	for literal, word in TOKEN_RE.findall(content):
+		if literal:
+			tokens.add(literal)
+		elif word:
+			tokens.update(dotted_tokens(word))
+	return tokens
+
+
+class SourceIndex(object):
+	"""Persistent token index of one source tree.
+
+	Files are keyed by path, size and mtime; update() only re-reads files
+	that changed since the last run, and key lookups are index queries."""
+
+	def __init__(self, index_file):
+		self.db = sqlite3.connect(index_file)
+		if self.db.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+			self.db.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS refs;')
+			self.db.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+		self.db.executescript(
+			'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL);'
+			'CREATE TABLE IF NOT EXISTS refs (token TEXT, path TEXT);'
+			'CREATE INDEX IF NOT EXISTS refs_token ON refs (token);'
+			'CREATE INDEX IF NOT EXISTS refs_path ON refs (path);')
+
+	def _forget(self, path):
+		self.db.execute('DELETE FROM refs WHERE path = ?', (path,))
+		self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+	def update(self, dir_name):
+		"""Sync the index with dir_name and return the number of files re-read."""
+		known = dict((row[0], (row[1], row[2])) for row in self.db.execute('SELECT path, size, mtime FROM files'))
+		seen = set()
+		changed = 0
+		for dirpath, dirnames, filenames in os.walk(dir_name):
+			for fname in filenames:
+				path = _to_text(os.path.abspath(os.path.join(dirpath, fname)))
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				seen.add(path)
+				if known.get(path) == (st.st_size, st.st_mtime):
+					continue
+				tokens = file_tokens(path)
+				if tokens is None:
+					continue
+				self._forget(path)
+				self.db.execute('INSERT INTO files VALUES (?, ?, ?)', (path, st.st_size, st.st_mtime))
+				self.db.executemany('INSERT INTO refs VALUES (?, ?)', [(t, path) for t in tokens])
+				changed += 1
+		for path in set(known) - seen:
+			self._forget(path)
+		self.db.commit()
+		return changed
+
+	def __contains__(self, key):
+		row = self.db.execute('SELECT 1 FROM refs WHERE token = ? LIMIT 1', (_to_text(key),)).fetchone()
+		return row is not None
+
+	def close(self):
+		self.db.close()
+
+
+DEFAULT_EXCLUDES = ['.git', '.svn', '.hg', 'Pods', 'Carthage', '*.xcassets', '*.xcodeproj']
+BINARY_SNIFF_SIZE = 8192
+MMAP_THRESHOLD = 1 << 20
+
+
+def _read_gitignore(dirpath):
+	try:
+		with open(os.path.join(dirpath, '.gitignore')) as f:
+			lines = f.read().splitlines()
+	except IOError:
+		return []
+	# negations ("!pattern") are not supported and simply ignored
+	return [(dirpath, line.strip()) for line in lines
+		if line.strip() and not line.startswith('#') and not line.startswith('!')]
+
+
+def _excluded(path, name, is_dir, exclude, ignores):
+	if any(fnmatch.fnmatch(name, g) for g in exclude):
+		return True
+	for base, pat in ignores:
+		if pat.endswith('/'):
+			if not is_dir:
+				continue
+			pat = pat.rstrip('/')
+		if '/' in pat:
+			rel = os.path.relpath(path, base).replace(os.sep, '/')
+			if fnmatch.fnmatch(rel, pat.lstrip('/')):
+				return True
+		elif fnmatch.fnmatch(name, pat):
+			return True
+	return False
+
+
+def iter_source_files(dir_name, include=None, exclude=DEFAULT_EXCLUDES, gitignore=True):
+	"""Yield the files under dir_name that pass the include/exclude globs and .gitignore."""
+	inherited = {}
+	for dirpath, dirnames, filenames in os.walk(dir_name):
+		ignores = inherited.pop(dirpath, [])
+		if gitignore:
+			ignores = ignores + _read_gitignore(dirpath)
+		dirnames[:] = [d for d in dirnames
+			if not _excluded(os.path.join(dirpath, d), d, True, exclude, ignores)]
+		for d in dirnames:
+			inherited[os.path.join(dirpath, d)] = ignores
+		for fname in filenames:
+			fullname = os.path.join(dirpath, fname)
+			if include and not any(fnmatch.fnmatch(fname, g) for g in include):
+				continue
+			if not _excluded(fullname, fname, False, exclude, ignores):
+				yield fullname
+
+
+def is_binary(head):
+	return b'\0' in head
+
+
+_scan_pattern = None
+
+
+def _init_scan_worker(pattern_source):
+	global _scan_pattern
+	_scan_pattern = re.compile(pattern_source)
+
+
+def scan_file(fname):
+	"""Return the keys found in fname; binary and unreadable files give []."""
+	try:
+		with open(fname, 'rb') as f:
+			if is_binary(f.read(BINARY_SNIFF_SIZE)):
+				return []
+			size = os.fstat(f.fileno()).st_size
+			if size == 0:
+				return []
+			if size >= MMAP_THRESHOLD:
+				data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				try:
+					return list(set(m.group(1) for m in _scan_pattern.finditer(data)))
+				finally:
+					data.close()
+			f.seek(0)
+			data = f.read()
+	except (IOError, OSError, ValueError):
+		return []
+	return list(set(m.group(1) for m in _scan_pattern.finditer(data)))
+
+
+def parallel_match(dir_name, keys, processes=None, include=None, exclude=DEFAULT_EXCLUDES, gitignore=True):
+	"""Like multi_match, but files are scanned by a process pool, large files
+	are memory-mapped and binaries, excluded and git-ignored paths are skipped."""
+	text_keys = dict((_to_text(k), k) for k in keys if k)
+	found = set()
+	if not text_keys:
+		return found
+	source = _keys_regex(text_keys).encode('utf-8')
+	files = iter_source_files(dir_name, include, exclude, gitignore)
+	pool = multiprocessing.Pool(processes, _init_scan_worker, (source,))
+	try:
+		for hits in pool.imap_unordered(scan_file, files, 16):
+			for hit in hits:
+				hit = hit.decode('utf-8', 'replace')
+				for i in range(1, len(hit) + 1):
+					if hit[:i] in text_keys:
+						found.add(text_keys[hit[:i]])
+			if len(found) == len(text_keys):
+				break
+	finally:
+		pool.terminate()
+		pool.join()
+	return found
+
+
 if __name__ == '__main__':
-	strings_file = sys.argv[1]
-	src_dir_name = sys.argv[2]
+	parser = argparse.ArgumentParser(description='List keys of a .strings file that are used in a source tree')
+	parser.add_argument('strings_file')
+	parser.add_argument('src_dir_name')
+	parser.add_argument('--engine', choices=['multi', 'rgrep', 'index', 'parallel'], default='multi',
+		help='multi: read every file once for all keys; rgrep: walk the tree once per key; '
+			'index: look keys up in a persistent token index, re-reading only changed files; '
+			'parallel: like multi, on a process pool, skipping binaries and ignored paths')
+	parser.add_argument('--index-file', default='.unused_string_index',
+		help='index database used by --engine index (default: %(default)s)')
+	parser.add_argument('--unused', action='store_true', help='print unused entries instead of used ones')
+	parser.add_argument('--jobs', type=int, help='worker processes for --engine parallel (default: all cores)')
+	parser.add_argument('--include', action='append', metavar='GLOB', help='only scan files matching GLOB')
+	parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+		help='skip files and directories matching GLOB, in addition to %s' % ', '.join(DEFAULT_EXCLUDES))
+	parser.add_argument('--no-gitignore', action='store_true', help='do not honour .gitignore files')
+	args = parser.parse_args()
+
+	entries = parse_strings_file(args.strings_file)
+	keys = set(key for key, item in entries if key)
+	if args.engine == 'rgrep':
+		used = set(key for key in keys if rgrep_match(args.src_dir_name, key))
+	elif args.engine == 'index':
+		index = SourceIndex(args.index_file)
+		index.update(args.src_dir_name)
+		used = set(key for key in keys if key in index)
+		index.close()
+	elif args.engine == 'parallel':
+		used = parallel_match(args.src_dir_name, keys, args.jobs, args.include,
+			DEFAULT_EXCLUDES + args.exclude, not args.no_gitignore)
+	else:
+		used = multi_match(args.src_dir_name, keys)
 
-	for item in open(strings_file).readlines():
-		grep_for = item.strip().split(' = ')[0].replace('"','')
-		if rgrep_match(src_dir_name, grep_for):
-			print item.strip()
\ No newline at end of file
+	for key, item in entries:
+		if key and (key in used) != args.unused:
+			print item.strip()
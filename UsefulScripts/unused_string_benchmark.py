@@ -0,0 +1,186 @@
+from __future__ import print_function
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import traceback
+import multiprocessing
+try:
+	from queue import Empty
+except ImportError:
+	from Queue import Empty
+
+import unused_string
+
+ENGINES = ['rgrep', 'multi', 'parallel', 'index-cold', 'index-warm']
+
+CODE_LINES = [
+	'	self.view.backgroundColor = [UIColor whiteColor];',
+	'	[self.tableView reloadData];',
+	'	let cell = tableView.dequeueReusableCell(withIdentifier: "Cell", for: indexPath)',
+	'	NSLog(@"%@", error.localizedDescription);',
+	'	if (completion) { completion(nil); }',
+	'	return CGSizeMake(width, 44.0);',
+]
+
+
+def generate_tree(root, files, keys, used_ratio=0.7, lines_per_file=200, binary_ratio=0.05, seed=0):
+	"""Write a synthetic iOS project under root and return the path of its
+	Localizable.strings file. Roughly used_ratio of the keys are referenced."""
+	rnd = random.Random(seed)
+	key_names = ['screen_%d.label_%d' % (i // 20, i) for i in range(keys)]
+	used = [k for k in key_names if rnd.random() < used_ratio]
+
+	strings_file = os.path.join(root, 'Localizable.strings')
+	with open(strings_file, 'w') as f:
+		for k in key_names:
+			f.write('"%s" = "Text for %s";\n' % (k, k))
+
+	src = os.path.join(root, 'src')
+	for i in range(files):
+		dirpath = os.path.join(src, 'Module%d' % (i // 50))
+		if not os.path.isdir(dirpath):
+			os.makedirs(dirpath)
+		if rnd.random() < binary_ratio:
+			with open(os.path.join(dirpath, 'Image%d.png' % i), 'wb') as f:
+				f.write(b'\x89PNG\r\n\x1a\n\0' + os.urandom(lines_per_file * 40))
+			continue
+		ext = rnd.choice(['.m', '.swift'])
+		with open(os.path.join(dirpath, 'File%d%s' % (i, ext)), 'w') as f:
+			for n in range(lines_per_file):
+				if used and rnd.random() < 0.05:
+					f.write('	label.text = NSLocalizedString(@"%s", nil);\n' % rnd.choice(used))
+				else:
+					f.write(rnd.choice(CODE_LINES) + '\n')
+	return strings_file
+
+
+def tree_stats(dir_name):
+	count = size = 0
+	for dirpath, dirnames, filenames in os.walk(dir_name):
+		for fname in filenames:
+			count += 1
+			size += os.path.getsize(os.path.join(dirpath, fname))
+	return count, size
+
+
+def run_engine(engine, keys, src_dir, index_file):
+	if engine == 'rgrep':
+		return set(k for k in keys if unused_string.rgrep_match(src_dir, k))
+	if engine == 'multi':
+		return unused_string.multi_match(src_dir, keys)
+	if engine == 'parallel':
+		return unused_string.parallel_match(src_dir, keys)
+	index = unused_string.SourceIndex(index_file)
+	try:
+		index.update(src_dir)
+		return set(k for k in keys if k in index)
+	finally:
+		index.close()
+
+
+def _peak_rss_bytes():
+	peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(engine, keys, src_dir, index_file, queue):
+	try:
+		start = time.time()
+		used = run_engine(engine, keys, src_dir, index_file)
+		queue.put((None, (time.time() - start, len(used), _peak_rss_bytes())))
+	except Exception:
+		queue.put((traceback.format_exc(), None))
+
+
+def measure(engine, keys, src_dir, index_file):
+	"""Run one engine in a fresh process so peak memory is its own.
+
+	Raises RuntimeError if the engine fails or the child dies without a result."""
+	queue = multiprocessing.Queue()
+	proc = multiprocessing.Process(target=_measure, args=(engine, keys, src_dir, index_file, queue))
+	proc.start()
+	while True:
+		try:
+			error, result = queue.get(timeout=1)
+			break
+		except Empty:
+			if not proc.is_alive():
+				raise RuntimeError('engine %s exited with code %s without a result' % (engine, proc.exitcode))
+	proc.join()
+	if error:
+		raise RuntimeError('engine %s failed:\n%s' % (engine, error))
+	return result
+
+
+def benchmark(files, keys, engines, workdir=None):
+	root = tempfile.mkdtemp(prefix='unused_string_bench_', dir=workdir)
+	try:
+		strings_file = generate_tree(root, files, keys)
+		src_dir = os.path.join(root, 'src')
+		n_files, n_bytes = tree_stats(src_dir)
+		entry_keys = set(k for k, item in unused_string.parse_strings_file(strings_file) if k)
+		index_file = os.path.join(root, 'index.sqlite')
+
+		results = []
+		for engine in engines:
+			if engine == 'index-warm' and not os.path.exists(index_file):
+				measure('index-cold', entry_keys, src_dir, index_file)
+			elif engine == 'index-cold' and os.path.exists(index_file):
+				os.remove(index_file)
+			elapsed, used, peak = measure(engine, entry_keys, src_dir, index_file)
+			results.append({
+				'engine': engine,
+				'files': n_files,
+				'bytes': n_bytes,
+				'keys': len(entry_keys),
+				'used_keys': used,
+				'seconds': elapsed,
+				'files_per_sec': n_files / elapsed if elapsed else None,
+				'bytes_per_sec': n_bytes / elapsed if elapsed else None,
+				'peak_rss_bytes': peak,
+			})
+		return results
+	finally:
+		shutil.rmtree(root)
+
+
+def print_table(results):
+	print('%-11s %8s %7s %6s %9s %12s %12s %10s' % (
+		'engine', 'files', 'keys', 'used', 'seconds', 'files/s', 'MB/s', 'peak MB'))
+	for r in results:
+		print('%-11s %8d %7d %6d %9.3f %12.1f %12.2f %10.1f' % (
+			r['engine'], r['files'], r['keys'], r['used_keys'], r['seconds'],
+			r['files_per_sec'] or 0, (r['bytes_per_sec'] or 0) / 1e6, r['peak_rss_bytes'] / 1e6))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark unused_string.py engines on a synthetic project tree')
+	parser.add_argument('--files', type=int, default=2000, help='source files to generate (default: %(default)s)')
+	parser.add_argument('--keys', type=int, default=300, help='Localizable.strings keys (default: %(default)s)')
+	parser.add_argument('--engines', default=','.join(ENGINES),
+		help='comma separated subset of %s; rgrep is O(keys x files), keep the tree small' % ', '.join(ENGINES))
+	parser.add_argument('--workdir', help='where to generate the tree (default: system temp dir)')
+	parser.add_argument('--json', action='store_true', help='print results as JSON')
+	args = parser.parse_args()
+
+	engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+	for e in engines:
+		if e not in ENGINES:
+			parser.error('unknown engine %s' % e)
+
+	results = benchmark(args.files, args.keys, engines, args.workdir)
+	if args.json:
+		print(json.dumps(results, indent=2))
+	else:
+		print_table(results)
+		counts = set(r['used_keys'] for r in results if r['engine'] != 'rgrep' and not r['engine'].startswith('index'))
+		if len(counts) > 1:
+			print('warning: substring engines disagree on the number of used keys', file=sys.stderr)